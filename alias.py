@@ -1,7 +1,13 @@
 import dash
+from dash import Patch
 from dash.dependencies import Input, Output, State
+import backend
 
-def assign_alias(app):
+def alias_line(name, alias, n):
+    return f'{name}\t{alias}\t{n}'
+
+
+def assign_alias(app, sessions):
     @app.callback(
         [Output('alias-history','value'),
          Output('x-axis','options'),
@@ -9,18 +15,34 @@ def assign_alias(app):
          Output('symbol','options'),
          Output('size','options'),
          Output('color','options'),
-         Output('hover-data','options')],
-        Input('submit-alias', 'n_clicks'),
+         Output('hover-data','options'),
+         Output('name','options')],
+        [Input('submit-alias', 'n_clicks'),
+         Input('session-key', 'data')],
         [State('name','value'),
-         State('alias','value'),
-         State('alias-history','value'),
-         State('x-axis', 'options')]
+         State('alias','value')]
     )
-    def update_aliases(submit_alias, name, alias, alias_history, current_options):
+    def update_aliases(submit_alias, key, name, alias):
+        if key is None:
+            return dash.no_update
+        if dash.callback_context.triggered_id != 'submit-alias':
+            # page load or a session opened, show its aliases in full
+            history = sessions.get(key)['alias_history']
+            options = backend.current().options
+            aliased = options + [{'label': a, 'value': n} for n, a, _ in history]
+            return ('\n' + '\n'.join(alias_line(*h) for h in history) if history else '',
+                    ) + (aliased,) * 6 + (options,)
         if alias is not None and name is not None:
-            current_options.append({'label': alias, 'value': name})
-            return (alias_history + '\n' +
-                    f'{name}\t{alias}\t{submit_alias}',) + (current_options,) * 6
+            def add(state):
+                state['aliases'][name] = alias
+                state['alias_history'].append([name, alias, submit_alias])
+            sessions.update(key, add)
+            # only the new alias is sent, appended to what the browser has
+            history = Patch()
+            history += '\n' + alias_line(name, alias, submit_alias)
+            aliased = Patch()
+            aliased.append({'label': alias, 'value': name})
+            return (history,) + (aliased,) * 6 + (dash.no_update,)
         return dash.no_update
 
     return app
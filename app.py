@@ -4,24 +4,51 @@ Copyright (C) 2020 David Ollodart
 GNU General Public License <https://www.gnu.org/licenses/>.
 """
 
+import logging
+import os
+import threading
+import uuid
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State, ALL, MATCH
-import pandas as pd
-from data import df, options
-from layouts import *
-from fig_updater import fig_updater
-from filter import assign_filter, apply_filter
+from dash.dependencies import Input, Output, State, ALL
+from dash.exceptions import PreventUpdate
+import data
+from refresh import Refresher, Follower, SQLiteRefresher, source_fetch
+import backend
+from session import SessionStore, assign_session
+from scheduler import Scheduler, Superseded
+from cache import LRUCache, canonical_key
+from decimate import parse_relayout
+from patch import figure_patch
+from metrics import metrics, register_metrics_route
+from plotly.io.json import to_json_plotly
+from serialize import compact_figure, figure_nbytes, use_fast_json
+from layouts import main_layout, aliasing_layout, filtering_layout
+from fig_updater import fig_updater, make_executor, aggregated_by_backend
+from grouping import bin_width
+from filter import assign_filter, describe_filters
 from smooth import assign_smooth
 from alias import assign_alias
 from nav import assign_nav
 
-def create_dash_app():
-    fig = fig_updater(df, xs=['dateRep'], ys=['cases_weekly']) 
-    graph_layout = dcc.Graph(figure=fig, id='plot')
-    app = dash.Dash(suppress_callback_exceptions=True)
-    app.layout = html.Div([
+logger = logging.getLogger(__name__)
+
+def serve_layout():
+    """
+    Page layout, built on every page load. The column options are those of
+    the backend loaded by warm_up: until it is, the dropdowns start empty
+    and the alias callback fills them (see alias.assign_alias), so the
+    page never waits for the data. The figure is left to the figure
+    callback, which finds the default figure cached by warm_up.
+    """
+    options = backend.current().options if backend.loaded() else []
+    graph_layout = html.Div([dcc.Graph(id='plot'),
+        dcc.Store(id='figure-key'), # cache key of the figure shown
+        dcc.Store(id='session-key', storage_type='local'),
+        # identifies the page, as tabs sharing a session all show figures
+        dcc.Store(id='page-key', data=uuid.uuid4().hex)])
+    return html.Div([
         dcc.Location(id='url', refresh=False),
         html.H1(children='Plotly Graph Builder'),
         dcc.Link('/main', href='/main'),
@@ -29,64 +56,276 @@ def create_dash_app():
         dcc.Link('/filtering', href='/filtering'),
         html.Br(),
         dcc.Link('/aliasing', href='/aliasing'),
-        html.Div(id='page-content',children=[main_layout,aliasing_layout,filtering_layout,graph_layout])
+        html.Div(id='page-content',children=[main_layout(options),
+            aliasing_layout(options),filtering_layout,graph_layout])
     ])
+
+
+def create_dash_app():
+    """
+    The app with its callbacks and routes. Creating it loads no data: that
+    happens on the first request, in a background warm_up (see
+    start_warm_up), so a server can import and fork the app cheaply and
+    poll /ready until it can serve.
+    """
+    app = dash.Dash(suppress_callback_exceptions=True)
+    app.layout = serve_layout
+    app = assign_nav(app)
+    app = assign_session(app)
+    app = assign_filter(app, sessions)
+    app = assign_smooth(app)
+    app = assign_alias(app, sessions)
+    app = assign_figure(app)
+    register_metrics_route(app.server, metrics, caches=dict(figures=figure_cache))
+    register_ready_route(app.server)
+    app.server.before_request(start_warm_up)
     return app
 
-app = create_dash_app()
-app = assign_nav(app)
-app = assign_filter(app)
-app = assign_smooth(app)
-app = assign_alias(app)
-
-@app.callback(
-    [Output('plot', 'figure'),
-     Output('current-filters', 'value')],
-    [Input('x-axis', 'value'),
-     Input('y-axis', 'value'),
-     Input('symbol', 'value'),
-     Input('size', 'value'),
-     Input('color', 'value'),
-     Input('hover-data', 'value'),
-     Input('cartesian-prod','value'),
-     Input('smoother', 'value'),
-     Input('smoother-slider', 'value'),
-     Input({'type': 'filter-update', 'index': ALL}, 'n_clicks')
-     ],
-    [State({'type': 'filter-dropdown', 'index': ALL}, 'value'),
-         State({'type': 'filter-lb', 'index': ALL}, 'value'),
-         State({'type': 'filter-ub', 'index': ALL}, 'value'),
-         State('current-filters', 'value')])
-def all_figure_callbacks(x, y, 
-        symbol, size, color, hover_data, 
-        cartesian_prod, 
-        smoother, smoother_slider,
-        filter_nclicks, filter_fields, filter_lbs, filter_ubs, filter_history):
-
-    has_filter = False
+# compact figures (see serialize.compact_figure), GRAPH_BUILDER_FIGURE_CACHE_MB
+# of them at most
+figure_cache = LRUCache(maxsize=None, sizeof=figure_nbytes,
+        maxbytes=int(float(os.environ.get('GRAPH_BUILDER_FIGURE_CACHE_MB', 256)) * 2**20))
+point_budget = 10000 # most points sent per trace, None to send every row
+# GRAPH_BUILDER_JSON_ENGINE=orjson serializes the callback outputs with
+# orjson, faster for figures without hover data but slower for those with
+# it (see python bench.py --serialize), hence not the default
+json_engine = os.environ.get('GRAPH_BUILDER_JSON_ENGINE', 'json')
+executor = make_executor('thread') # 'thread', 'process' or None for serial traces
+# figures are built by GRAPH_BUILDER_FIGURE_WORKERS threads, one per page at
+# a time, bursts of changes on a page coalescing to the latest. Neither pool
+# starts a thread before its first task, so importing the app starts none.
+scheduler = Scheduler(int(os.environ.get('GRAPH_BUILDER_FIGURE_WORKERS', 4)))
+
+# figures of the previous data version are never asked for again
+data.on_swap(lambda dataset: figure_cache.clear())
+# new data is fetched every GRAPH_BUILDER_REFRESH seconds (0 to disable)
+# from GRAPH_BUILDER_SOURCE, a url or the path of a local csv drop
+refresh_interval = float(os.environ.get('GRAPH_BUILDER_REFRESH', 3600))
+source = os.environ.get('GRAPH_BUILDER_SOURCE', data.source)
+# GRAPH_BUILDER_BACKEND=sqlite queries data.sqlite, built from the csv in
+# chunks, instead of the table in memory, which is then never loaded
+backend.configure(os.environ.get('GRAPH_BUILDER_BACKEND', 'frame'))
+refresher = Refresher(source_fetch(source), interval=refresh_interval)
+# with GRAPH_BUILDER_SHARED=<directory> one worker process publishes the
+# data there and the others map it read-only, following its versions
+data.share(os.environ.get('GRAPH_BUILDER_SHARED'))
+follower = Follower()
+# aliases and filters of every session, saved under GRAPH_BUILDER_SESSIONS
+# when set so that they outlive the server
+sessions = SessionStore(os.environ.get('GRAPH_BUILDER_SESSIONS'))
+
+ready = threading.Event() # set once warm_up is done
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+def warm_up():
+    """
+    Load the data (see backend.current), cache the default figure and
+    start the refresher, so that the first page load finds everything
+    ready. Also switches plotly's JSON engine when json_engine asks for
+    orjson (see serialize.use_fast_json), a global setting, which is why
+    it's done when serving rather than on import.
+    """
+    if json_engine == 'orjson':
+        use_fast_json()
+    # the figure of the default dropdown values, with the empty filter
+    update_figure(['dateRep'], ['cases_weekly'], None, None, None, None,
+            False, 'none', 5, [None], None, None, [None], [None], [None], None)
+    if refresh_interval > 0:
+        if isinstance(backend.current(), backend.SQLiteBackend):
+            SQLiteRefresher(source, interval=refresh_interval).start()
+        else:
+            (refresher if data.publishes() else follower).start()
+    ready.set()
+
+
+def start_warm_up():
+    """
+    Run warm_up in a background thread, the first call only. Called
+    before every request, or directly e.g. after forking a worker.
+    """
+    global _warm_up_thread
+    if _warm_up_thread is not None:
+        return
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            def run():
+                try:
+                    warm_up()
+                except Exception:
+                    logger.exception('warm up failed')
+            _warm_up_thread = threading.Thread(target=run, name='warm-up', daemon=True)
+            _warm_up_thread.start()
+
+
+def register_ready_route(server, path='/ready'):
+    """
+    Readiness route: 200 once warm_up is done, 503 until then.
+    """
+    from flask import jsonify
+
+    @server.route(path)
+    def readiness():
+        if not ready.is_set():
+            return jsonify(ready=False), 503
+        return jsonify(ready=True, version=backend.current().version)
+
+    return server
+
+
+def assign_figure(app):
+
+    @app.callback(
+        [Output('plot', 'figure'),
+         Output('current-filters', 'value'),
+         Output('figure-key', 'data')],
+        [Input('x-axis', 'value'),
+         Input('y-axis', 'value'),
+         Input('symbol', 'value'),
+         Input('size', 'value'),
+         Input('color', 'value'),
+         Input('hover-data', 'value'),
+         Input('cartesian-prod','value'),
+         Input('smoother', 'value'),
+         Input('smoother-slider', 'value'),
+         Input({'type': 'filter-update', 'index': ALL}, 'n_clicks'),
+         Input('plot', 'relayoutData'),
+         Input('session-key', 'data'),
+         Input('plot-mode', 'value'),
+         Input('aggregate', 'value'),
+         Input('x-bin', 'value')
+         ],
+        [State({'type': 'filter-dropdown', 'index': ALL}, 'value'),
+             State({'type': 'filter-lb', 'index': ALL}, 'value'),
+             State({'type': 'filter-ub', 'index': ALL}, 'value'),
+             State('figure-key', 'data'),
+             State('page-key', 'data')])
+    def all_figure_callbacks(x, y, 
+            symbol, size, color, hover_data, 
+            cartesian_prod, 
+            smoother, smoother_slider,
+            filter_nclicks, relayout, session_key,
+            plot_mode, aggregate, x_bin,
+            filter_fields, filter_lbs, filter_ubs, shown_key, page_key):
+
+        restore = dash.callback_context.triggered_id in (None, 'session-key')
+        try:
+            with metrics.request('figure_update'):
+                # the stages of the job are recorded into this request
+                return scheduler.run(page_key, metrics.bind(update_figure), x, y, symbol,
+                        size, color, hover_data, cartesian_prod, smoother,
+                        smoother_slider, filter_nclicks, relayout, session_key,
+                        filter_fields, filter_lbs, filter_ubs, shown_key, restore,
+                        plot_mode, aggregate, bin_width(x_bin, 'f'))
+        except Superseded: # the page already asked for a later figure
+            metrics.record('superseded', 1)
+            raise PreventUpdate
+
+    return app
+
+
+def update_figure(x, y, symbol, size, color, hover_data, cartesian_prod,
+        smoother, smoother_slider, filter_nclicks, relayout, session_key,
+        filter_fields, filter_lbs, filter_ubs, shown_key, restore=False,
+        plot_mode='points', aggregate='sum', x_bin=None):
+
+    source = backend.current() # the same data throughout the update
     nnone = []
     for i in range(len(filter_fields)):
         if filter_fields[i] is not None:
-            has_filter = True
             nnone.append((filter_fields[i], filter_lbs[i], filter_ubs[i]))
 
-    if has_filter:
-        f, l, u = zip(*nnone)
-        gbl, filter_history_update = apply_filter(f, l, u)
-        filter_history += f'{filter_nclicks}\n' + filter_history_update
+    state = sessions.get(session_key)
+    if smoother == 'none':
+        smoother_slider = None
+    hover_labels = state['aliases']
+    # zoomed ranges are sent at full resolution, only matters when decimating
+    ranges = parse_relayout(relayout) if point_budget is not None else None
+    key = canonical_key(x=x, y=y, symbol=symbol, size=size, color=color,
+            hover_data=hover_data or None,
+            hover_labels={k: hover_labels[k] for k in hover_data or () if k in hover_labels},
+            cartesian_prod=cartesian_prod,
+            smoother=smoother, smoother_parameter=smoother_slider,
+            plot_mode=plot_mode, aggregate=aggregate, x_bin=x_bin,
+            filters=sorted(nnone, key=str), version=source.version,
+            point_budget=point_budget, ranges=ranges)
+
+    fig = figure_cache.get(key)
+    metrics.record('cache_hit', fig is not None)
+    if fig is None:
+        scheduler.checkpoint()
+        if aggregated_by_backend(source.schema, y, color, symbol, plot_mode, aggregate):
+            df = None # grouped by the backend, no row is read
+        else:
+            # only the plotted columns of the filtered rows are read
+            columns = [*x, *y, symbol, size, color, *(hover_data or ()), 'dummy']
+            with metrics.stage('filter'):
+                df = source.query([c for c in columns if c is not None], nnone)
+        scheduler.checkpoint()
+        with metrics.stage('fig_updater'):
+            fig = fig_updater(df, x, y,
+                    symbol=symbol,
+                    size=size,
+                    color=color,
+                    hover_data=hover_data,
+                    hover_labels=hover_labels,
+                    cartesian_prod=cartesian_prod,
+                    smoother=smoother,
+                    smoother_parameter=smoother_slider,
+                    schema=source.schema,
+                    point_budget=point_budget,
+                    ranges=ranges,
+                    executor=executor,
+                    stats=source.stats.filtered(nnone),
+                    plot_mode=plot_mode,
+                    aggregate=aggregate,
+                    x_bin=x_bin,
+                    source=source,
+                    filters=nnone)
+        # keep the user's zoom while the plotted columns stay the same
+        fig.update_layout(transition_duration=500,
+                uirevision=str((x, y, cartesian_prod)))
+        with metrics.stage('compact'):
+            fig = compact_figure(fig)
+        figure_cache.put(key, fig)
+    scheduler.checkpoint()
+
+    # the browser only gets what is added to the filter history, unless
+    # the session was just opened. Saved only now, as a superseded update
+    # never reaches the browser.
+    added = f'{filter_nclicks}\n' + describe_filters(*zip(*nnone)) if nnone else ''
+    # nor is anything saved on restoring, the filters shown may not be the
+    # session's yet
+    if session_key is not None and not restore:
+        def apply(state):
+            state['filters'] = [list(f) for f in nnone]
+            if added:
+                state['filter_history'].append(added)
+        state = sessions.update(session_key, apply)
+    if restore:
+        filter_history = ''.join(state['filter_history'])
+    elif added:
+        filter_history = dash.Patch()
+        filter_history += added
     else:
-        gbl = [True]*len(df)
+        filter_history = dash.no_update
 
-    fig = fig_updater(df[gbl], x, y,
-            symbol=symbol,
-            size=size,
-            color=color,
-            hover_data=hover_data,
-            cartesian_prod=cartesian_prod,
-            smoother=smoother,
-            smoother_parameter=smoother_slider)
-    fig.update_layout(transition_duration=500)
-    return fig, filter_history
+    # send only the trace and layout properties which changed since the
+    # figure shown, when that figure is still cached
+    shown = figure_cache.peek(shown_key) if shown_key is not None else None
+    output = fig
+    if shown is not None:
+        with metrics.stage('patch'):
+            patch, changed = figure_patch(shown, fig)
+        if patch is not None:
+            output = patch if changed else dash.no_update
+    if metrics.enabled and output is not dash.no_update:
+        with metrics.stage('serialize'):
+            metrics.record('payload_bytes', len(to_json_plotly(output)))
+    return output, filter_history, key
+
+app = create_dash_app()
 
 if __name__ == '__main__':
+    start_warm_up()
     app.run_server(debug=True)
@@ -0,0 +1,512 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+import data
+from grouping import bin_origin, bin_values, bin_width, backend_aggregations, group_aggregate, sortable
+from schema import Schema, compact, common_dtype
+from stats import ColumnStats
+
+class FrameBackend:
+    """
+    Backend over an in-memory dataset (see data.Dataset), filtering with
+    its FilterEngine.
+
+    Every backend has a schema, version and column statistics (see
+    stats.ColumnStats) and answers query, chunks, count, levels and
+    aggregate for filters given as (field, lb, ub) triples, as entered in
+    the filter dropdowns (see filter_engine.FilterEngine.mask).
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.schema = dataset.schema
+        self.version = dataset.version
+        self.options = dataset.options
+        self.stats = ColumnStats(self)
+
+    def _mask(self, filters):
+        if not filters:
+            return None
+        return self.dataset.engine.apply(*zip(*filters))
+
+    def query(self, columns, filters=()):
+        """
+        The given columns of the rows passing the filters.
+        """
+        columns = list(dict.fromkeys(columns))
+        gbl = self._mask(filters)
+        return self.dataset.df[columns] if gbl is None else self.dataset.df.loc[gbl, columns]
+
+    def chunks(self, columns, filters=(), chunksize=1000000):
+        """
+        query in parts of at most chunksize rows.
+        """
+        frame = self.query(columns, filters)
+        for start in range(0, len(frame), chunksize):
+            yield frame.iloc[start:start + chunksize]
+
+    def count(self, filters=()):
+        gbl = self._mask(filters)
+        return len(self.dataset.df) if gbl is None else int(gbl.sum())
+
+    def levels(self, column, filters=()):
+        """
+        Row count of each value of the column, missing values left out.
+        """
+        counts = self.query([column], filters)[column].value_counts(sort=False)
+        return counts[counts > 0]
+
+    def aggregate(self, x, ys, by=(), how='sum', x_bin=None, filters=()):
+        """
+        Aggregates of the columns ys of the rows passing the filters, per
+        distinct values of the columns by and bin of x (see
+        grouping.bin_values), rows with missing x left out. None for x
+        groups by the columns by alone.
+
+        Inputs:
+          how: one of grouping.backend_aggregations
+        Outputs:
+          frame with a row per group sorted by (by, x), missing values
+          last: the values of by
+          as k0, k1..., the bin as x, the aggregates as y0, y1..., the
+          number of rows as rows and, as first, a number increasing with
+          the position of the group's first row
+        """
+        columns = [*by, *([] if x is None else [x]), *ys]
+        return aggregate_frame(self.query(columns, filters), x, ys, by, how, x_bin)
+
+
+def aggregate_frame(frame, x, ys, by=(), how='sum', x_bin=None):
+    """
+    aggregate (see FrameBackend.aggregate) of the rows of a frame, with
+    grouping.group_aggregate as the figures aggregated from rows (see
+    fig_updater.aggregate_groups), so both give the same values.
+    """
+    if how not in backend_aggregations:
+        raise ValueError(f'unknown aggregation {how!r}')
+    codes = np.zeros(len(frame), dtype=np.int64)
+    for col in by: # missing values last
+        c, uniq = pd.factorize(frame[col], sort=True, use_na_sentinel=False)
+        codes = codes * len(uniq) + c
+    xbins = np.zeros(len(frame)) if x is None else bin_values(frame[x].to_numpy(), x_bin)
+    position = sortable(xbins)
+    first, rows = group_aggregate(codes, position, np.ones((len(frame), 1)), 'count')
+
+    result = {f'k{i}': frame[col].array[first] for i, col in enumerate(by)}
+    if x is not None:
+        result['x'] = xbins[first]
+    result['rows'] = rows['y'][:, 0]
+    result['first'] = first
+    if ys:
+        Y = frame[list(ys)].to_numpy(dtype=float, na_value=np.nan)
+        _, stats = group_aggregate(codes, position, Y, how)
+        for i in range(len(ys)):
+            result[f'y{i}'] = stats['y'][:, i]
+    return pd.DataFrame(result)
+
+
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# declared column types, datetimes being stored as nanoseconds since the epoch
+sql_types = {'M': 'TIMESTAMP', 'b': 'BOOLEAN', 'i': 'INTEGER', 'u': 'INTEGER', 'f': 'REAL'}
+
+def sql_columns(df):
+    """
+    Columns of the typed table as stored in SQLite and their declared
+    types (see sql_types).
+    """
+    columns, types = {}, {}
+    for col in df.columns:
+        series = df[col]
+        kind = 'O' if isinstance(series.dtype, pd.CategoricalDtype) else series.dtype.kind
+        if kind == 'M':
+            ns = series.astype('datetime64[ns]')
+            series = pd.Series(ns.to_numpy().astype(np.int64), index=df.index).mask(ns.isna())
+        elif kind == 'b':
+            series = series.astype(np.int8)
+        elif kind not in 'iuf':
+            series = series.astype(object).where(series.notna(), None).map(
+                    lambda v: v if v is None else str(v))
+        columns[col] = series
+        types[col] = sql_types.get(kind, 'TEXT')
+    return pd.DataFrame(columns), types
+
+
+def write_sqlite(df, path='data.sqlite', table='data', version=0):
+    """
+    Store the typed table in an SQLite file, version as its user_version
+    (see sqlite_version) and the dtypes of the columns in the table
+    <table>_dtypes, so they are restored when read. Written to a temporary
+    file of the same directory, unique to the writer, and renamed, so open
+    connections keep reading the old file.
+    """
+    write_sqlite_chunks([df], path, table, version)
+
+
+def write_sqlite_chunks(chunks, path='data.sqlite', table='data', version=0):
+    """
+    write_sqlite of a table given in parts, appended one at a time, so it
+    needn't fit in memory. Column types are declared from the first part,
+    the dtypes stored hold the values of every part (see
+    schema.common_dtype).
+    """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        con = sqlite3.connect(tmp)
+        with con:
+            types, dtypes = None, {}
+            for chunk in chunks:
+                frame, chunk_types = sql_columns(chunk)
+                frame.to_sql(table, con, index=False, dtype=types or chunk_types,
+                        if_exists='append' if types else 'replace')
+                types = types or chunk_types
+                for col in chunk.columns:
+                    dtypes[col] = common_dtype(dtypes.get(col), chunk[col].dtype)
+            pd.DataFrame(dict(name=list(dtypes), dtype=[str(d) for d in dtypes.values()])).to_sql(
+                    f'{table}_dtypes', con, index=False, if_exists='replace')
+            con.execute(f'PRAGMA user_version = {int(version)}')
+        con.close()
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def sqlite_version(path='data.sqlite'):
+    """
+    Version of the table written to path by write_sqlite, None when there
+    is no file.
+    """
+    if not os.path.exists(path):
+        return None
+    con = sqlite3.connect(path)
+    try:
+        return con.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        con.close()
+
+
+# dtypes of the stored columns, unless stored with the table (see write_sqlite)
+sql_dtypes = {'TIMESTAMP': 'datetime64[ns]', 'BOOLEAN': 'bool', 'INTEGER': 'int64',
+        'REAL': 'float64', 'TEXT': 'category'}
+sql_aggregations = dict(sum='TOTAL', mean='AVG', count='COUNT', min='MIN', max='MAX')
+
+class SQLiteBackend:
+    """
+    Backend over a table in an SQLite file (see write_sqlite), so the data
+    needn't fit in memory. Filters become a WHERE clause, only the columns
+    asked for are read and value counts are grouped in SQLite. A column
+    gets an index the first time it is filtered on.
+    """
+
+    def __init__(self, path='data.sqlite', table='data', version=0):
+        self.path = path
+        self.table = table
+        self.version = version
+        self._local = threading.local() # sqlite3 connections are per thread
+        self._indexed = set()
+        self.types = {row[1]: row[2].upper() for row in
+                self._connection().execute(f'PRAGMA table_info({quote(table)})')}
+        self.schema = Schema({col: 'continuous' if t in ('TIMESTAMP', 'INTEGER', 'REAL')
+            else 'discrete' for col, t in self.types.items()})
+        self.options = [{'label': i, 'value': i} for i in self.types]
+        try:
+            stored = dict(self._connection().execute(
+                f'SELECT name, dtype FROM {quote(table + "_dtypes")}').fetchall())
+        except sqlite3.OperationalError: # written without dtypes
+            stored = {}
+        self.dtypes = {col: pd.api.types.pandas_dtype(stored.get(col, sql_dtypes[t]))
+                for col, t in self.types.items()}
+        self.stats = ColumnStats(self)
+
+    def _connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.path)
+        return con
+
+    def _index(self, field):
+        if field in self._indexed:
+            return
+        name = quote(f'{self.table}_{field}')
+        with self._connection() as con:
+            con.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {quote(self.table)} ({quote(field)})')
+        self._indexed.add(field)
+
+    def parse_bound(self, field, bound):
+        if self.types[field] == 'TIMESTAMP':
+            return pd.Timestamp(bound).value
+        return float(bound)
+
+    def where(self, filters):
+        """
+        WHERE clause and its parameters for the filters, matching
+        FilterEngine: strict bounds for continuous columns, a comma
+        separated list of values in lb for discrete ones.
+        """
+        clauses, params = [], []
+        for field, lb, ub in filters:
+            self._index(field)
+            if self.schema.is_continuous(field):
+                clauses.append(f'{quote(field)} > ? AND {quote(field)} < ?')
+                params += [self.parse_bound(field, lb), self.parse_bound(field, ub)]
+            else:
+                eqs = [i.strip() for i in lb.split(',')]
+                clauses.append(f'{quote(field)} IN ({", ".join("?" * len(eqs))})')
+                params += eqs
+        if not clauses:
+            return '', params
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+    def restore(self, frame, sources=None):
+        """
+        Dtypes of the table in memory (see dtypes) from the stored columns,
+        sources mapping the columns of frame to restore to the stored
+        column they were read from, when not every column is one.
+        Integers with missing values stay floats.
+        """
+        if sources is None:
+            sources = {col: col for col in frame.columns}
+        for col, source in sources.items():
+            frame[col] = self.cast(frame[col], self.types[source], self.dtypes[source])
+        return frame
+
+    @staticmethod
+    def cast(values, t, dtype):
+        """
+        Values of the stored type t as dtype.
+        """
+        if t == 'TIMESTAMP':
+            values = pd.to_datetime(values, unit='ns')
+        elif t == 'BOOLEAN':
+            values = values.astype(bool)
+        if dtype.kind in 'iub' and values.isna().any():
+            return values
+        return values.astype(dtype)
+
+    def _select(self, columns, filters):
+        columns = list(dict.fromkeys(columns))
+        where, params = self.where(filters)
+        # in table order, as an index used by the WHERE clause reorders rows
+        sql = f'SELECT {", ".join(map(quote, columns))} FROM {quote(self.table)}{where} ORDER BY rowid'
+        return sql, params
+
+    def query(self, columns, filters=()):
+        """
+        The given columns of the rows passing the filters, in table order.
+        """
+        sql, params = self._select(columns, filters)
+        return self.restore(pd.read_sql_query(sql, self._connection(), params=params))
+
+    def chunks(self, columns, filters=(), chunksize=1000000):
+        """
+        query in parts of at most chunksize rows, read one at a time.
+        """
+        sql, params = self._select(columns, filters)
+        for chunk in pd.read_sql_query(sql, self._connection(), params=params, chunksize=chunksize):
+            yield self.restore(chunk)
+
+    def count(self, filters=()):
+        where, params = self.where(filters)
+        sql = f'SELECT COUNT(*) FROM {quote(self.table)}{where}'
+        return self._connection().execute(sql, params).fetchone()[0]
+
+    def levels(self, column, filters=()):
+        """
+        Row count of each value of the column, missing values left out.
+        """
+        where, params = self.where(filters)
+        where += (' AND ' if where else ' WHERE ') + f'{quote(column)} IS NOT NULL'
+        sql = (f'SELECT {quote(column)}, COUNT(*) AS count FROM {quote(self.table)}{where} '
+               f'GROUP BY {quote(column)}')
+        frame = pd.read_sql_query(sql, self._connection(), params=params)
+        return frame['count'].set_axis(self.restore(frame[[column]])[column])
+
+    def aggregate(self, x, ys, by=(), how='sum', x_bin=None, filters=()):
+        """
+        See FrameBackend.aggregate, grouped in SQLite.
+        """
+        if how not in backend_aggregations:
+            raise ValueError(f'unknown aggregation {how!r}')
+        width = None if x is None else bin_width(x_bin, self.dtypes[x].kind)
+
+        selected = [f'{quote(col)} AS k{i}' for i, col in enumerate(by)]
+        sources = {f'k{i}': col for i, col in enumerate(by)}
+        params = []
+        if x is not None:
+            column = quote(x)
+            if width is None:
+                selected.append(f'{column} AS x')
+                sources['x'] = x
+            elif self.types[x] == 'TIMESTAMP': # nanoseconds floored from grouping.bin_origin
+                selected.append(f'{column} - ((({column} - ?) % ?) + ?) % ? AS x')
+                params += [bin_origin.value] + [width.value] * 3
+            else: # floor(x / width) * width, SQLite having no floor
+                # the width in the precision of the bins in memory
+                width = np.asarray(width, dtype=self.bin_dtype(x, x_bin)).item()
+                ratio = f'{column} / ?'
+                selected.append(f'(CAST({ratio} AS INTEGER) - ({ratio} < CAST({ratio} AS INTEGER))) * ? AS x')
+                params += [width] * 4
+        ngroups = len(selected)
+        selected += ['COUNT(*) AS "rows"', 'MIN(rowid) AS "first"']
+        selected += [f'{sql_aggregations[how]}({quote(y)}) AS y{i}' for i, y in enumerate(ys)]
+
+        where, where_params = self.where(filters)
+        if x is not None:
+            where += (' AND ' if where else ' WHERE ') + f'{quote(x)} IS NOT NULL'
+        sql = f'SELECT {", ".join(selected)} FROM {quote(self.table)}{where}'
+        if ngroups:
+            ordinals = [str(i + 1) for i in range(ngroups)]
+            sql += f' GROUP BY {", ".join(ordinals)} ORDER BY {" NULLS LAST, ".join(ordinals)} NULLS LAST'
+        frame = pd.read_sql_query(sql, self._connection(), params=params + where_params)
+        frame = frame[frame['rows'] > 0].reset_index(drop=True)
+        for i in range(len(ys)): # counts are integers, as in grouping.group_aggregate
+            frame[f'y{i}'] = frame[f'y{i}'].astype(np.int64 if how == 'count' else float)
+        if width is not None:
+            frame['x'] = self.cast(frame['x'], self.types[x], self.bin_dtype(x, x_bin))
+        return self.restore(frame, sources)
+
+    def bin_dtype(self, x, x_bin):
+        """
+        Dtype of the bins of the column x in memory (see grouping.bin_values).
+        """
+        return bin_values(np.empty(0, dtype=self.dtypes[x]), x_bin).dtype
+
+
+def load_sqlite(csv_path='data.csv', path='data.sqlite', table='data', chunksize=100000):
+    """
+    Build the SQLite file from the source csv, chunksize rows at a time
+    (see data.read_source_chunks), unless the file is newer than the csv.
+    The table is never in memory as a whole. The source is downloaded
+    first when there is no csv yet, as in data.load.
+
+    Outputs:
+      version of the file, one more than that of the file replaced
+    """
+    if not os.path.exists(csv_path):
+        data.download(data.source, csv_path)
+    version = sqlite_version(path)
+    if not stale(path, csv_path):
+        return version
+    version = 0 if version is None else version + 1
+    # compacted part by part, the dtypes stored being those of every part
+    write_sqlite_chunks((compact(data.subset(chunk)) for chunk in
+        data.read_source_chunks(csv_path, chunksize)), path, table, version)
+    return version
+
+
+def stale(path='data.sqlite', csv_path='data.csv'):
+    """
+    Whether the SQLite file is missing or older than the csv.
+    """
+    return (sqlite_version(path) is None or
+            os.path.getmtime(path) < os.path.getmtime(csv_path))
+
+
+_builder = None # lock file held by the process building the sqlite file
+
+def builds(path='data.sqlite'):
+    """
+    Whether this process builds the SQLite file at path (see load_sqlite).
+    The first process to ask takes a lock next to the file and builds
+    every version; the others open the versions it writes. A process
+    asks again on every refresh, taking over when the builder is gone.
+    """
+    global _builder
+    if _builder is None:
+        import fcntl
+        lock = open(path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        _builder = lock # held as long as the process lives
+    return True
+
+
+def open_sqlite(path='data.sqlite', csv_path='data.csv', newer_than=-1):
+    """
+    SQLiteBackend over the file at path, built from the csv by the
+    process which builds it (see builds). The others open the file
+    written, first waiting until it is there and not older than the csv
+    when newer_than is negative. None when the version isn't newer than
+    newer_than.
+    """
+    if builds(path):
+        version = load_sqlite(csv_path, path)
+    else:
+        while newer_than < 0 and (not os.path.exists(csv_path) or stale(path, csv_path)):
+            time.sleep(0.1)
+        version = sqlite_version(path)
+    if version is None or version <= newer_than:
+        return None
+    return SQLiteBackend(path, version=version)
+
+
+_current = None
+_kind, _path = 'frame', 'data.sqlite'
+_lock = threading.Lock()
+
+def current():
+    """
+    Backend of the current data, built on first use: over the current
+    dataset (see data.current) for the 'frame' kind and over the SQLite
+    file (see open_sqlite) for the 'sqlite' kind, which never loads the
+    table in memory. See configure.
+    """
+    global _current
+    if _current is None:
+        with _lock:
+            if _current is None:
+                if _kind == 'sqlite':
+                    _current = open_sqlite(_path)
+                else:
+                    data.on_swap(_rebuild)
+                    _current = FrameBackend(data.current())
+    return _current
+
+
+def loaded():
+    return _current is not None
+
+
+def _rebuild(dataset):
+    global _current
+    _current = FrameBackend(dataset)
+
+
+def configure(kind='frame', path='data.sqlite'):
+    """
+    Use a backend of the given kind ('frame' or 'sqlite'), path being the
+    sqlite file. Nothing is loaded until current is called.
+    """
+    global _kind, _path
+    _kind, _path = kind, path
+
+
+def refresh_sqlite(csv_path='data.csv'):
+    """
+    For the 'sqlite' kind, switch to a newer version of the SQLite file:
+    the process building it (see builds) rebuilds it when the csv is
+    newer, the others open the version it wrote. Returns the new backend,
+    None when there's none.
+    """
+    global _current
+    source = current()
+    backend = open_sqlite(source.path, csv_path, newer_than=source.version)
+    if backend is not None:
+        _current = backend
+    return backend
@@ -0,0 +1,292 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+
+Benchmarks of the plotting pipeline on synthetic data.
+
+Every result is one JSON object per line, so runs of two versions can be
+compared with --compare:
+
+    python bench.py --rows 100000 --output before.jsonl
+    python bench.py --rows 100000 --compare before.jsonl
+
+--startup also times the app's cold start, run where the app finds its
+data.csv. --check instead checks that every figure fig_updater assembles
+equals the one built through the validating plotly API, and --serialize
+times and sizes the JSON of the figures as plotly lists and as compact
+typed arrays (see serialize.compact_figure), with the json and orjson
+engines.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+from schema import Schema, compact
+from fig_updater import fig_updater
+from backend import FrameBackend
+from data import Dataset
+from filter import apply_filter
+from smooth import whittaker_smooth
+from serialize import compact_figure
+
+def synthetic(rows=100000, levels=20, spacing='1D', nan_fraction=0.0, seed=0):
+    """
+    Synthetic table shaped like the ECDC data: a date column with the
+    given spacing, per-level random walks, a categorical color column
+    with the given number of levels and a three level symbol column.
+    A nan_fraction of the numeric values is missing.
+    """
+    rng = np.random.default_rng(seed)
+    level = rng.integers(0, levels, rows)
+    df = pd.DataFrame({
+        'date': pd.Timestamp('2020-01-01') + pd.to_timedelta(spacing) * np.sort(rng.integers(0, rows // levels + 1, rows)),
+        'level': pd.Categorical.from_codes(level, [f'level{i}' for i in range(levels)]),
+        'group': pd.Categorical.from_codes(rng.integers(0, 3, rows), ['A', 'B', 'C']),
+        'cases': rng.poisson(100, rows) * (1 + level),
+        'deaths': rng.poisson(5, rows),
+        'rate': rng.standard_normal(rows).cumsum(),
+        'population': rng.integers(10**5, 10**9, rows),
+        })
+    for col in ('cases', 'deaths', 'rate'):
+        missing = rng.random(rows) < nan_fraction
+        if missing.any():
+            df[col] = df[col].astype(float).mask(missing)
+    df = compact(df)
+    df['dummy'] = True
+    return df
+
+
+configurations = {
+    'single': dict(xs=['date'], ys=['cases']),
+    'multi-x': dict(xs=['date', 'deaths'], ys=['cases']),
+    'multi-y': dict(xs=['date'], ys=['cases', 'rate']),
+    'cartesian': dict(xs=['date', 'deaths'], ys=['cases', 'rate'], cartesian_prod=True),
+}
+
+smoothers = {
+    'none': dict(),
+    'whittaker': dict(smoother='whittaker', smoother_parameter=2),
+    'moving-average': dict(smoother='moving-average', smoother_parameter=7),
+}
+
+hovers = {
+    'no-hover': dict(),
+    'hover': dict(hover_data=['level', 'date', 'population']),
+}
+
+modes = {
+    'points': dict(),
+    'density': dict(render_mode='density'),
+    'bar': dict(plot_mode='bar', x_bin=7),
+    'box': dict(plot_mode='box'),
+}
+
+
+def timeit(f, repeat):
+    """
+    Minimum and median wall time of repeat calls of f, and its last result.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), float(np.median(times)), result
+
+
+def bench_fig_updater(df, schema, repeat, legend):
+    for cname, configuration in configurations.items():
+        for sname, smoothing in smoothers.items():
+            for hname, hover in hovers.items():
+                kwargs = dict(configuration, **smoothing, **hover, schema=schema, **legend)
+                best, median, fig = timeit(lambda: fig_updater(df, **kwargs), repeat)
+                yield dict(name=f'fig_updater/{cname}/{sname}/{hname}',
+                        min=best, median=median, traces=len(fig.data))
+                if sname == 'none' and hname == 'hover':
+                    # serialized as Dash serializes callback outputs
+                    best, median, text = timeit(lambda: to_json_plotly(fig, engine='json'), repeat)
+                    yield dict(name=f'to_json/{cname}', min=best, median=median, bytes=len(text))
+                    if importlib.util.find_spec('orjson'):
+                        best, median, text = timeit(lambda: to_json_plotly(compact_figure(fig), engine='orjson'), repeat)
+                        yield dict(name=f'to_json/{cname}/compact', min=best, median=median, bytes=len(text))
+
+
+def bench_serialize(df, schema, repeat, legend):
+    """
+    Encoding time (compact_figure included) and bytes of the figures of
+    every configuration in each encoding, with their ratios to the plotly
+    lists of the json engine, which Dash uses by default.
+    """
+    engines = ('json', 'orjson') if importlib.util.find_spec('orjson') else ('json',)
+    for cname, configuration in configurations.items():
+        for hname, hover in hovers.items():
+            fig = fig_updater(df, **configuration, **hover, schema=schema, **legend)
+            base = None
+            for encoding in ('lists', 'compact'):
+                prepare = compact_figure if encoding == 'compact' else (lambda fig: fig)
+                for engine in engines:
+                    best, median, text = timeit(lambda: to_json_plotly(prepare(fig), engine=engine), repeat)
+                    result = dict(name=f'serialize/{cname}/{hname}/{encoding}/{engine}',
+                            min=best, median=median, bytes=len(text))
+                    base = base or result
+                    result.update(time_ratio=best / base['min'], bytes_ratio=len(text) / base['bytes'])
+                    yield result
+
+
+def check_assemble(df, schema, legend):
+    """
+    Compare the figures of fig_updater, which assembles them without
+    validation (see fig_updater.assemble), with the same figures built
+    through the validating plotly API, as parsed JSON.
+    """
+    for cname, configuration in configurations.items():
+        for sname, smoothing in smoothers.items():
+            for mname, mode in modes.items():
+                kwargs = dict(configuration, **smoothing, **hovers['hover'], **mode,
+                        schema=schema, **legend)
+                fast, validated = (json.loads(to_json_plotly(fig_updater(df, validate=validate, **kwargs),
+                    engine='json')) for validate in (False, True))
+                yield dict(name=f'check_assemble/{cname}/{sname}/{mname}', equal=fast == validated)
+
+
+def bench_filter(df, repeat):
+    fields, lbs, ubs = ('cases', 'level'), ('100', 'level1, level2, level3'), ('500', None)
+    columns = ['date', 'cases', 'level']
+    # a new backend has no sorted index, codes or masks yet
+    best, median, rows = timeit(lambda: apply_filter(fields, lbs, ubs, columns,
+        FrameBackend(Dataset(None, df=df)))[0], repeat)
+    yield dict(name='apply_filter/cold', min=best, median=median, selected=len(rows))
+    source = FrameBackend(Dataset(None, df=df))
+    apply_filter(fields, lbs, ubs, columns, source)
+    best, median, rows = timeit(lambda: apply_filter(fields, lbs, ubs, columns, source)[0], repeat)
+    yield dict(name='apply_filter/cached', min=best, median=median, selected=len(rows))
+
+
+def bench_whittaker(repeat):
+    rng = np.random.default_rng(0)
+    for n in (1000, 10000, 100000):
+        y = rng.standard_normal(n).cumsum()
+        for lmbd in (1e2, 1e4):
+            best, median, _ = timeit(lambda: whittaker_smooth(y, lmbd), repeat)
+            yield dict(name=f'whittaker_smooth/{n}/{lmbd:g}', min=best, median=median)
+
+
+# run in a fresh interpreter, so that nothing is imported yet
+startup_script = '''
+import json, sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.server.test_client()
+client.get('/ready')
+app.ready.wait()
+warm = time.perf_counter()
+client.get('/')
+client.get('/_dash-layout')
+client.get('/_dash-dependencies')
+first = time.perf_counter()
+print(json.dumps(dict(import_app=imported - start, warm_up=warm - imported,
+        first_request=first - warm)))
+'''
+
+def bench_startup(repeat):
+    """
+    Import time of the app, time until /ready and time of the first page
+    load, without the refresher.
+    """
+    script = startup_script % os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                text=True, check=True, env=dict(os.environ, GRAPH_BUILDER_REFRESH='0'))
+        runs.append(json.loads(out.stdout.splitlines()[-1]))
+    for name in runs[0]:
+        times = [run[name] for run in runs]
+        yield dict(name=f'startup/{name}', min=min(times), median=float(np.median(times)))
+
+
+def compare(results, path, tolerance):
+    """
+    Print the change of each median against a previous run, flagging
+    those slower by more than tolerance (a fraction).
+    """
+    with open(path) as _:
+        previous = {r['name']: r for r in map(json.loads, _)}
+    slower = 0
+    for r in results:
+        if r['name'] not in previous:
+            continue
+        change = r['median'] / previous[r['name']]['median'] - 1
+        flag = 'SLOWER' if change > tolerance else ''
+        slower += bool(flag)
+        print(f"{r['name']:50s} {change:+8.1%} {flag}", file=sys.stderr)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--levels', type=int, default=20,
+            help='number of color levels')
+    parser.add_argument('--spacing', default='1D',
+            help='date spacing, a pandas timedelta string')
+    parser.add_argument('--nan-fraction', type=float, default=0.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--compare', help='results file of a previous run')
+    parser.add_argument('--startup', action='store_true',
+            help="also time the app's cold start")
+    parser.add_argument('--check', action='store_true',
+            help='check assembled figures instead of timing')
+    parser.add_argument('--serialize', action='store_true',
+            help='time and size the JSON encodings of the figures instead')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+            help='relative slowdown flagged by --compare')
+    args = parser.parse_args(argv)
+
+    df = synthetic(args.rows, args.levels, args.spacing, args.nan_fraction, args.seed)
+    schema = Schema.from_frame(df)
+    setup = dict(rows=args.rows, levels=args.levels, spacing=args.spacing,
+            nan_fraction=args.nan_fraction)
+
+    results = []
+    legend = dict(color='level', symbol='group')
+    benches = (bench_fig_updater(df, schema, args.repeat, legend),
+            bench_filter(df, args.repeat),
+            bench_whittaker(args.repeat))
+    if args.startup:
+        benches += (bench_startup(args.repeat),)
+    if args.serialize:
+        benches = (bench_serialize(df, schema, args.repeat, legend),)
+    if args.check:
+        benches = (check_assemble(df, schema, legend),)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for bench in benches:
+            for result in bench:
+                result.update(setup)
+                results.append(result)
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    finally:
+        if args.output:
+            out.close()
+
+    if args.check:
+        return 0 if all(result['equal'] for result in results) else 1
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
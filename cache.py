@@ -0,0 +1,87 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used entries once more
+    than maxsize entries, or more than maxbytes bytes as measured by
+    sizeof(value), are stored, counting hits and misses. Either bound may
+    be None. A value larger than maxbytes on its own isn't stored.
+    """
+
+    def __init__(self, maxsize=32, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """
+        Value of key without counting a hit or miss or refreshing its use.
+        """
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key, value):
+        nbytes = 0 if self.sizeof is None else self.sizeof(value)
+        with self._lock:
+            self.nbytes += nbytes - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = nbytes
+            self._data.move_to_end(key)
+            while self._data and ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                    (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+                old, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(old)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def info(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._data), maxsize=self.maxsize,
+                    nbytes=self.nbytes, maxbytes=self.maxbytes)
+
+
+def canonical_key(**kwargs):
+    """
+    Hash keyword arguments into a key which is the same for equal inputs,
+    independent of keyword order. Tuples and lists hash the same.
+    """
+    text = json.dumps(kwargs, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
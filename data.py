@@ -3,40 +3,357 @@ Copyright (C) 2020 David Ollodart
 GNU General Public License <https://www.gnu.org/licenses/>.
 """
 
+import json
+import os
+import shutil
+import time
+import uuid
+from threading import Lock
+import numpy as np
 import pandas as pd
-from dash_html_components import Datalist, Option
 from datetime import datetime
+from schema import Schema, compact
+from filter_engine import FilterEngine
 
-try:
-    with open('last-update.txt', 'r') as _:
-        dtime = _.read().strip('\n')
-        dtime = datetime.strptime(dtime, '%Y-%m-%d')
-        ddays = (datetime.now() - dtime).days # days is the largest unit of time difference
-        if ddays > 7:
-            1/0
-        df = pd.read_csv('data.csv')
-except (FileNotFoundError, ZeroDivisionError):
+source = 'https://opendata.ecdc.europa.eu/covid19/casedistribution/csv'
+x1 = 'dateRep'
+
+def read_source(path):
+    """
+    Parse the source csv into a typed table with compact dtypes.
+    """
+    df = pd.read_csv(path)
+    df[x1] = pd.to_datetime(df[x1], dayfirst=True)
+    return compact(df)
+
+
+def read_source_chunks(path, chunksize=100000):
+    """
+    read_source in parts of at most chunksize rows, so the table needn't
+    fit in memory. Dtypes aren't compacted, as they'd differ between parts.
+    """
+    for df in pd.read_csv(path, chunksize=chunksize):
+        df[x1] = pd.to_datetime(df[x1], dayfirst=True)
+        yield df
+
+
+def write_columnar(df, path='data.feather'):
+    """
+    Store the typed table as uncompressed Arrow IPC (feather), which keeps
+    parsed datetimes and categories and can be memory-mapped when read.
+    """
+    from pyarrow import feather
+    # written aside and renamed, a table still mapped from the old file
+    # keeps reading the old file
+    feather.write_feather(df.reset_index(drop=True), path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+
+def read_columnar(path='data.feather', columns=None):
+    """
+    Read the columnar file memory-mapped, only the given columns if any.
+    Columns are selected by the reader and the table converted once, so
+    unused columns are never read. Splitting blocks lets numeric columns
+    without missing values stay views of the mapped file.
+    """
+    from pyarrow import feather
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def load(csv_path='data.csv', columnar_path='data.feather', columns=None):
+    """
+    Load the table, or only the given columns, downloading the source
+    only if there is no csv yet, staleness being left to the background
+    refresher (see refresh.py). The csv is parsed once into a columnar
+    file, which is rebuilt whenever the csv is newer. Without pyarrow the
+    csv is parsed on every load.
+    """
+    if not os.path.exists(csv_path):
+        download(source, csv_path)
+
+    try:
+        if (not os.path.exists(columnar_path) or
+                os.path.getmtime(columnar_path) < os.path.getmtime(csv_path)):
+            write_columnar(read_source(csv_path), columnar_path)
+        return read_columnar(columnar_path, columns)
+    except ImportError: # pyarrow is not installed
+        df = read_source(csv_path)
+        return df if columns is None else df[columns]
+
+
+def download(url, csv_path='data.csv'):
+    """
+    Download the source csv, noting the date in last-update.txt.
+    """
+    df = pd.read_csv(url)
+    with open(csv_path, 'w') as _:
+        df.to_csv(_, index=False)
     with open('last-update.txt', 'w') as _:
         _.write(datetime.now().strftime('%Y-%m-%d'))
-    df = pd.read_csv('https://opendata.ecdc.europa.eu/covid19/casedistribution/csv')
-    with open('data.csv', 'w') as _:
-        df.to_csv(_, index=False)
 
 
-numeric_dtypes = ['int64', 'int32', 'float32', 'float64', 'datetime64[ns]']
-x1 = 'dateRep'
-gbl = df['geoId'].isin(['US', 'BR', 'IN'])
-df = df[gbl] # data subset for testing
-df[x1] = pd.to_datetime(df[x1], dayfirst=True)
-options = [{'label': x, 'value': x} for x in df.columns]
-df['dummy'] = True # dummy column used for some boolean tests
-
-dlists = []
-for col in df.columns:
-    if df[col].nunique() < 15: 
-        # only suggest for those with a small number of options
-        uniq = df[col].unique()
-        dlists.append(Datalist([Option(x) for x in uniq], id=col))
-
-options = [{'label': i, 'value': i} for i in df.columns]
-types = {k:'continuous' if v in numeric_dtypes else 'discrete' for k,v in df.dtypes.items()}
+def publish(df, directory, version):
+    """
+    Write the table to a new subdirectory of directory, one .npy file per
+    column, and make it the published version. Categorical and string
+    columns are stored as integer codes with their categories. Versions
+    older than the one replaced are removed: processes still mapping
+    their files keep reading them until they attach again.
+    """
+    name = f'{version}-{uuid.uuid4().hex[:8]}'
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        column = dict(name=col, file=f'{i}.npy')
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype.kind not in 'biufM':
+            series = series.astype('category')
+            categories = np.asarray(series.cat.categories)
+            if categories.dtype.kind == 'O':
+                categories = categories.astype(str)
+            column['categories'] = f'{i}-categories.npy'
+            np.save(os.path.join(path, column['categories']), categories)
+            values = series.cat.codes.to_numpy()
+        else:
+            values = series.to_numpy()
+        np.save(os.path.join(path, column['file']), values)
+        columns.append(column)
+    np.save(os.path.join(path, 'index.npy'), df.index.to_numpy())
+    with open(os.path.join(path, 'meta.json'), 'w') as _:
+        json.dump(dict(version=version, columns=columns), _)
+
+    previous = _published_name(directory)
+    # the pointer is replaced in one step, readers see the old or new version
+    pointer = os.path.join(directory, 'current')
+    with open(pointer + '.tmp', 'w') as _:
+        _.write(name)
+    os.replace(pointer + '.tmp', pointer)
+    for entry in os.listdir(directory):
+        if entry not in (name, previous) and os.path.isdir(os.path.join(directory, entry)):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+def _published_name(directory):
+    try:
+        with open(os.path.join(directory, 'current'), 'r') as _:
+            return _.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def published_version(directory):
+    """
+    Version published to directory, None when nothing was published.
+    """
+    name = _published_name(directory)
+    return None if name is None else int(name.split('-')[0])
+
+
+def attach(directory):
+    """
+    Map the table published to directory read-only. Nothing is copied or
+    scanned, the columns being views of the mapped files, so attaching
+    takes about the same time whatever the size of the table.
+
+    Outputs:
+      (df, version), None when nothing was published
+    """
+    name = _published_name(directory)
+    if name is None:
+        return None
+    path = os.path.join(directory, name)
+    with open(os.path.join(path, 'meta.json'), 'r') as _:
+        meta = json.load(_)
+    columns = {}
+    for column in meta['columns']:
+        values = np.load(os.path.join(path, column['file']), mmap_mode='r')
+        if 'categories' in column:
+            categories = np.load(os.path.join(path, column['categories']))
+            values = pd.Categorical.from_codes(values, categories, validate=False)
+        columns[column['name']] = values
+    index = pd.Index(np.load(os.path.join(path, 'index.npy'), mmap_mode='r'), copy=False)
+    return pd.DataFrame(columns, index=index, copy=False), meta['version']
+
+
+def merge_rows(old, new, keys=('geoId', x1)):
+    """
+    Merge a newly fetched table into the current one. Rows of new whose
+    keys are not in old are appended, rows whose values changed replace
+    the old rows (and move to the end), unchanged rows are skipped.
+
+    Inputs:
+      old, new: typed tables (see read_source)
+      keys: columns identifying a row
+    Outputs:
+      (merged, added, changed), merged being old itself when nothing
+      was added or changed
+    """
+    keys = list(keys)
+    new = new.drop_duplicates(keys, keep='last')
+    pos = pd.MultiIndex.from_frame(old[keys]).get_indexer(pd.MultiIndex.from_frame(new[keys]))
+    matched = pos >= 0
+    differs = np.zeros(matched.sum(), dtype=bool)
+    before, after = old.iloc[pos[matched]], new[matched]
+    for col in new.columns.intersection(old.columns):
+        a, b = before[col].astype(object).to_numpy(), after[col].astype(object).to_numpy()
+        differs |= (a != b) & ~(pd.isna(a) & pd.isna(b))
+
+    take = ~matched
+    take[matched] = differs
+    added, changed = int((~matched).sum()), int(differs.sum())
+    if not take.any():
+        return old, 0, 0
+    keep = np.ones(len(old), dtype=bool)
+    keep[pos[matched][differs]] = False
+    merged = pd.concat([old[keep], new[take]], ignore_index=True)
+    return compact(merged), added, changed
+
+
+def subset(df):
+    """
+    Rows and derived columns of the source table used by the app.
+    """
+    # the selected rows are already a copy, a shallow one only detaches
+    # the frame so the dummy column can be added
+    df = df[df['geoId'].isin(['US', 'BR', 'IN'])].copy(deep=False) # data subset for testing
+    df['dummy'] = True # dummy column used for some boolean tests
+    return df
+
+
+class Dataset:
+    """
+    One version of the data with everything derived from it: the table
+    used by the app (df), dropdown options, column schema and filter
+    engine. A Dataset isn't changed after it is built, new data
+    makes a new Dataset (see swap), so a callback holding one sees
+    consistent data.
+
+    df is subset(table) unless given, e.g. mapped from shared files (see
+    attach), table being None in processes which only attach.
+    """
+
+    def __init__(self, table, version=0, df=None):
+        self.table = table # source table, before subset
+        self.version = version # identifies the dataset, e.g. in cache keys
+        self.df = df = subset(table) if df is None else df
+        self.options = [{'label': i, 'value': i} for i in df.columns]
+        self.schema = Schema.from_frame(df) # column roles shared by filter and fig_updater
+        self.engine = FilterEngine(df, schema=self.schema)
+
+
+_current = None # loaded on first use, importing reads no data
+_swap_lock = Lock()
+_listeners = []
+_shared = None # directory of the published data, see share
+_publisher = None # lock file held by the process publishing to _shared
+
+def share(directory):
+    """
+    Share the data between processes through directory, e.g. the workers
+    of a server. The first process to load the data takes a lock on the
+    directory, loads the data and publishes every version to it (see
+    publish); the others map the published files (see attach and follow)
+    instead of holding a copy each. None doesn't share.
+    """
+    global _shared
+    _shared = directory
+
+
+def publishes():
+    """
+    Whether this process loads and refreshes the data, which is false in
+    processes attached to data published by another.
+    """
+    return _shared is None or _publisher is not None
+
+
+def _publish(table, version):
+    publish(subset(table), _shared, version)
+    # used from the mapped files too, not kept in memory twice
+    return Dataset(table, version, attach(_shared)[0])
+
+
+def _load_shared():
+    global _publisher
+    import fcntl
+    os.makedirs(_shared, exist_ok=True)
+    lock = open(os.path.join(_shared, 'lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError: # another process publishes, wait for its data
+        lock.close()
+        attached = attach(_shared)
+        while attached is None:
+            time.sleep(0.1)
+            attached = attach(_shared)
+        df, version = attached
+        return Dataset(None, version, df)
+    _publisher = lock # held as long as the process lives
+    published = published_version(_shared)
+    return _publish(load(), 0 if published is None else published + 1)
+
+
+def current():
+    """
+    The current Dataset, loaded by the first call. Callbacks call this
+    once and use the result throughout, as it may be swapped while they
+    run.
+    """
+    global _current
+    if _current is None:
+        with _swap_lock:
+            if _current is None:
+                _current = Dataset(load()) if _shared is None else _load_shared()
+    return _current
+
+
+def loaded():
+    return _current is not None
+
+
+def on_swap(f):
+    """
+    Register f(dataset) to be called after a new dataset is swapped in,
+    e.g. to clear caches keyed on the previous version.
+    """
+    _listeners.append(f)
+    return f
+
+
+def swap(table):
+    """
+    Build a Dataset from the table and make it current. The reference is
+    replaced in one assignment, so callbacks see either the old or the new
+    dataset, never a mix.
+    """
+    global _current
+    current() # the first version, when swapping before any use
+    with _swap_lock:
+        version = _current.version + 1
+        dataset = Dataset(table, version) if _shared is None else _publish(table, version)
+        _current = dataset
+    for f in _listeners:
+        f(dataset)
+    return dataset
+
+
+def follow():
+    """
+    In a process attached to shared data (see share), swap in the version
+    last published when it is newer than the current one. Returns the new
+    dataset, None when there's none.
+    """
+    global _current
+    published = published_version(_shared)
+    if published is None or published <= current().version:
+        return None
+    with _swap_lock:
+        df, version = attach(_shared)
+        dataset = Dataset(None, version, df)
+        _current = dataset
+    for f in _listeners:
+        f(dataset)
+    return dataset
+
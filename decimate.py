@@ -0,0 +1,170 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+def numeric(values):
+    """
+    Values as floats (datetimes as nanoseconds), or None if not numeric.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]').astype(np.int64).astype(float)
+    elif values.dtype.kind in 'iufb':
+        return values.astype(float)
+    return None
+
+
+def bound(values, b):
+    """
+    Axis range bound (number or date string) in the units of numeric(values).
+    """
+    if np.asarray(values).dtype.kind == 'M':
+        return float(pd.Timestamp(b).value)
+    return float(b)
+
+
+def parse_relayout(relayout):
+    """
+    Axis ranges reported by a graph's relayoutData, as a dict mapping
+    axis names ('xaxis', 'yaxis2', ...) to (lower, upper). Autoranged
+    axes are left out.
+    """
+    ranges = {}
+    for key, value in (relayout or {}).items():
+        m = re.match(r'([xy]axis\d*)\.range(\[([01])\])?$', key)
+        if m is None:
+            continue
+        axis, i = m.group(1), m.group(3)
+        if i is None:
+            ranges[axis] = tuple(value)
+        else:
+            lu = list(ranges.get(axis, (None, None)))
+            lu[int(i)] = value
+            ranges[axis] = tuple(lu)
+    return {k: v for k, v in ranges.items() if None not in v}
+
+
+def lttb(x, y, n):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line sorted by x.
+
+    Reference:
+    Sveinn Steinarsson, "Downsampling Time Series for Visual
+    Representation", MSc thesis, University of Iceland, 2013
+
+    Returns the sorted positions of the n points kept.
+    """
+    L = len(x)
+    if n >= L or n < 3:
+        return np.arange(L)
+    edges = np.linspace(1, L - 1, n - 1).astype(int)
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, L - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i == n - 3:
+            avgx, avgy = x[-1], y[-1]
+        else:
+            avgx, avgy = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        area = np.abs((x[a] - avgx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avgy - y[a]))
+        a = lo + np.argmax(area)
+        out[i + 1] = a
+    return out
+
+
+def minmax(x, y, n):
+    """
+    Keep the lowest and highest point of each of n // 2 equal-width x
+    buckets (one bucket per pixel column for an n / 2 pixel wide plot).
+
+    Returns the sorted positions of the points kept.
+    """
+    nbuckets = max(n // 2, 1)
+    lo, hi = x.min(), x.max()
+    if hi > lo:
+        b = np.minimum(((x - lo) / (hi - lo) * nbuckets).astype(int), nbuckets - 1)
+    else:
+        b = np.zeros(len(x), dtype=int)
+    order = np.lexsort((y, b))
+    bs = b[order]
+    starts = np.flatnonzero(np.r_[True, bs[1:] != bs[:-1]])
+    ends = np.r_[starts[1:], len(bs)] - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+
+def _visible(x, y, xrange, yrange):
+    xn, yn = numeric(x), numeric(y)
+    if xn is None:
+        xn = np.arange(len(x), dtype=float)
+        xrange = None
+    if yn is None:
+        yn = np.arange(len(y), dtype=float)
+        yrange = None
+    keep = np.isfinite(xn) & np.isfinite(yn)
+    if xrange is not None:
+        keep &= (xn >= bound(x, xrange[0])) & (xn <= bound(x, xrange[1]))
+    if yrange is not None:
+        keep &= (yn >= bound(y, yrange[0])) & (yn <= bound(y, yrange[1]))
+    return xn, yn, keep
+
+
+def select_markers(x, y, budget=None, xrange=None, yrange=None):
+    """
+    Positions of the marker points to send: those inside the visible
+    ranges, min-max decimated down to the point budget.
+
+    Returns None when every point is kept.
+    """
+    xn, yn, keep = _visible(x, y, xrange, yrange)
+    idx = np.flatnonzero(keep)
+    if budget is not None and len(idx) > budget:
+        idx = idx[minmax(xn[idx], yn[idx], budget)]
+    return None if len(idx) == len(xn) else idx
+
+
+def select_line(x, y, budget=None, xrange=None):
+    """
+    Positions of the points of a line sorted by x to send: those inside
+    the visible x range plus one on each side, so the line runs to the
+    plot edges, downsampled by LTTB to the point budget. Missing y are
+    kept, breaking the line where the values are missing; downsampling
+    keeps the first of each run of them.
+
+    Returns None when every point is kept.
+    """
+    xn, yn = numeric(x), numeric(y)
+    if xn is None:
+        xn = np.arange(len(x), dtype=float)
+        xrange = None
+    if yn is None:
+        yn = np.arange(len(y), dtype=float)
+    keep = np.isfinite(xn)
+    if xrange is not None:
+        inside = (xn >= bound(x, xrange[0])) & (xn <= bound(x, xrange[1]))
+        inside = np.r_[inside[1:], False] | inside | np.r_[False, inside[:-1]]
+        keep &= inside
+    idx = np.flatnonzero(keep)
+    if budget is not None and len(idx) > budget:
+        gap = ~np.isfinite(yn[idx])
+        gaps = idx[gap & ~np.r_[False, gap[:-1]]]
+        points = idx[~gap]
+        points = points[lttb(xn[points], yn[points], max(budget - len(gaps), 3))]
+        idx = np.union1d(points, gaps)
+    return None if len(idx) == len(xn) else idx
+
+
+def take(values, idx):
+    """
+    values at positions idx, or values itself when idx is None.
+    """
+    if idx is None or values is None:
+        return values
+    elif isinstance(values, pd.Series):
+        return values.iloc[idx]
+    return np.asarray(values)[idx]
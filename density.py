@@ -0,0 +1,82 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from decimate import numeric, bound
+
+def extent(values, visible=None):
+    """
+    (lower, upper) of the values in the units of decimate.numeric, the
+    visible axis range when given. None for non-numeric values.
+    """
+    vn = numeric(values)
+    if vn is None:
+        return None
+    elif visible is not None:
+        return bound(values, visible[0]), bound(values, visible[1])
+    vn = vn[np.isfinite(vn)]
+    if len(vn) == 0:
+        return None
+    return vn.min(), vn.max()
+
+
+def centers(values, lu, n):
+    """
+    Bin centers of n equal bins over lu, as datetimes for datetime values.
+    """
+    width = (lu[1] - lu[0]) / n
+    c = lu[0] + width * (np.arange(n) + 0.5)
+    if np.asarray(values).dtype.kind == 'M':
+        return c.astype(np.int64).astype('datetime64[ns]')
+    return c
+
+
+def bin2d(x, y, xextent, yextent, bins=(200, 150), values=None):
+    """
+    Count (or mean of values) of the points in each cell of a grid of
+    bins[0] x bins[1] equal cells covering xextent x yextent.
+
+    Inputs:
+      x, y: point coordinates (numeric or datetime)
+      xextent, yextent: (lower, upper) in the units of decimate.numeric
+      bins: number of cells along x and y
+      values: optional values to average per cell
+    Outputs:
+      z: ny x nx array, NaN for empty cells
+    """
+    nx, ny = bins
+    xn, yn = numeric(x), numeric(y)
+    keep = np.isfinite(xn) & np.isfinite(yn)
+    keep &= (xn >= xextent[0]) & (xn <= xextent[1])
+    keep &= (yn >= yextent[0]) & (yn <= yextent[1])
+    if values is not None:
+        values = np.asarray(values, dtype=float)
+        keep &= np.isfinite(values)
+        values = values[keep]
+
+    def cell(vn, lu, n):
+        if lu[1] > lu[0]:
+            i = ((vn - lu[0]) / (lu[1] - lu[0]) * n).astype(np.int64)
+            return np.minimum(i, n - 1)
+        return np.zeros(len(vn), dtype=np.int64)
+
+    flat = cell(yn[keep], yextent, ny) * nx + cell(xn[keep], xextent, nx)
+    counts = np.bincount(flat, minlength=nx * ny).reshape(ny, nx).astype(float)
+    if values is None:
+        z = counts
+    else:
+        sums = np.bincount(flat, weights=values, minlength=nx * ny).reshape(ny, nx)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = sums / counts
+    z[counts == 0] = np.nan
+    return z
+
+
+def colorscale(color, low_alpha=0.15):
+    """
+    Single-hue colorscale from a translucent to an opaque hex color.
+    """
+    r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return [[0, f'rgba({r},{g},{b},{low_alpha})'], [1, f'rgba({r},{g},{b},1)']]
@@ -5,11 +5,17 @@ GNU General Public License <https://www.gnu.org/licenses/>.
 
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from smooth import whittaker_smooth
-from data import df, gbl, numeric_dtypes
+from smooth import whittaker_smooth_batch
+from grouping import legend_groups, rolling_mean, sortable, bin_values, group_aggregate, backend_aggregations
+from hover import hover_text, hover_customdata, hover_template
+from schema import Schema
+from decimate import select_markers, select_line, take
+from density import extent, centers, bin2d, colorscale
+from metrics import metrics
 from dash.dependencies import Input, Output
 
 #from scipy.interpolate import UnivariateSpline
@@ -32,7 +38,11 @@ def cartesian_product(xs, ys):
 
 def fig_updater(df, xs, ys, size=None, color=None, symbol=None, 
         hover_data = None, smoother = None, smoother_parameter=None, 
-        max_size=35, cartesian_prod = False):
+        max_size=35, cartesian_prod = False, hover_labels=None,
+        hover_mode='template', schema=None, point_budget=None, ranges=None,
+        render_mode='auto', density_threshold=1000000, density_bins=(200, 150),
+        executor=None, stats=None, plot_mode='points', aggregate='sum', x_bin=None,
+        source=None, filters=(), validate=False):
     """Evaluate inputs and updates the figure correctly based on inputs 
 
     x:
@@ -48,6 +58,48 @@ def fig_updater(df, xs, ys, size=None, color=None, symbol=None,
 
     cartesian_prod:
       bool, whether the list should be expanded
+    hover_labels:
+      dict, aliases to display for hover_data column names
+    hover_mode:
+      'template' to send the formatted hover columns once as customdata
+      with a shared hovertemplate, 'text' to send one hovertext per point
+    schema:
+      Schema of df, inferred from the dtypes if not given
+    point_budget:
+      int, most points sent per trace, markers are min-max decimated and
+      smoothed lines are LTTB downsampled beyond it
+    ranges:
+      dict, visible axis ranges (see decimate.parse_relayout), points
+      outside them are not sent
+    render_mode:
+      'points' for marker traces, 'density' for one heatmap of point
+      counts (mean size when size is continuous) per legend group and
+      subplot, 'auto' for density above density_threshold rows
+    density_bins:
+      (nx, ny), number of heatmap cells along x and y
+    executor:
+      concurrent.futures executor computing the traces of the legend
+      groups in parallel (see make_executor), None to compute serially
+    stats:
+      column statistics of df (see stats.ColumnStats) whose cached
+      quantiles bin continuous color and symbol, None to compute them
+    plot_mode:
+      'points' for the rows themselves, or 'bar', 'line' or 'box' for
+      traces of aggregates of y per legend group and x bin, computed on
+      the server (see aggregate_groups). Aggregates are neither smoothed,
+      decimated nor given hover data.
+    aggregate:
+      aggregation of y of the bar and line modes, see grouping.aggregations
+    x_bin:
+      width of the x bins of the aggregated modes (see grouping.bin_values),
+      None for a bin per distinct x
+    source, filters:
+      backend and filters of the rows of df. With df None, the legend
+      groups and aggregates are grouped by source (see backend_aggregates
+      and aggregated_by_backend) and no row is read
+    validate:
+      bool, build the figure through the validating plotly API instead
+      of assemble, slower, to check assemble (see bench.py --check)
 
     Relevant variables:
         Number of x variables
@@ -57,7 +109,8 @@ def fig_updater(df, xs, ys, size=None, color=None, symbol=None,
         Data types of size (must be numeric or will be "factorized"), color, symbol (must be categorical or will be histogramed)
     """
 
-    dtypes = df.dtypes.to_dict()
+    if schema is None:
+        schema = Schema.from_frame(df)
 
     shared_xaxes = shared_yaxes = False 
 
@@ -90,107 +143,548 @@ def fig_updater(df, xs, ys, size=None, color=None, symbol=None,
         else:
             xys = tuple( ((i % 2, i // 2), (xs[i], ys[i % m])) for i in range(n))
 
-    fig = make_subplots(rows=rows,
-            cols=cols, 
-            shared_yaxes=shared_yaxes,
-            shared_xaxes=shared_xaxes)
-
+    if df is not None:
+        metrics.record('rows', len(df))
+    with metrics.stage('make_subplots'):
+        # only for the layout of the grid, the figure itself is built once
+        # all traces are known (see assemble)
+        fig = make_subplots(rows=rows,
+                cols=cols, 
+                shared_yaxes=shared_yaxes,
+                shared_xaxes=shared_xaxes)
+
+    if df is None:
+        size = None # aggregates have no marker sizes
     if size is not None:
-        if not dtypes[size] in numeric_dtypes:
+        if schema.is_discrete(size):
             dfsize = disc2cont(df[size]) * max_size
         else:
-            dfsize = df[size] * max_size / df[size].max()
+            dfsize = df[size].astype(float) * max_size / df[size].max()
 
-    if color is not None: # color is used for legending, not quantitative heat maps
-        if dtypes[color] in numeric_dtypes:
-            dfcolor = cont2disc(df[color])
+    if df is None: # grouped by the backend
+        pass
+    elif color is not None: # color is used for legending, not quantitative heat maps
+        if schema.is_continuous(color):
+            dfcolor = cont2disc(df[color], q=quantiles(stats, color))
         else:
             dfcolor = df[color]
-        coloriter = dfcolor.unique()
     else:
         dfcolor = df['dummy']
-        coloriter = [True]
 
-    if symbol is not None: 
-        if dtypes[symbol] in numeric_dtypes:
-            dfsymbol = cont2disc(df[symbol]) # interval type
+    if df is None:
+        pass
+    elif symbol is not None: 
+        if schema.is_continuous(symbol):
+            dfsymbol = cont2disc(df[symbol], q=quantiles(stats, symbol)) # interval type
         else:
             dfsymbol = df[symbol]
-        symboliter = dfsymbol.unique()
     else:
         dfsymbol = df['dummy']
-        symboliter = [True]
 
-    for ccounter, c in enumerate(coloriter):
-        for scounter, s in enumerate(symboliter):
-            bl = (dfcolor == c) & (dfsymbol == s)
-            if bl.sum() < 2:
+    # density grids cover the same extent for every legend group of a subplot
+    extents = {}
+    # aggregates are never binned into density grids
+    if plot_mode == 'points' and (render_mode == 'density' or
+            (render_mode == 'auto' and len(df) > density_threshold)):
+        for (xcounter, ycounter), (xinst, yinst) in xys:
+            xrange, yrange = subplot_ranges(fig, ycounter+1, xcounter+1, ranges)
+            xe, ye = extent(df[xinst].values, xrange), extent(df[yinst].values, yrange)
+            if xe is not None and ye is not None: # categorical axes stay points
+                extents[xcounter, ycounter] = xe, ye
+
+    hovertemplate = None
+    if hover_data: # None or empty
+        hover_data = list(hover_data) # allow passing tuples
+        if hover_mode == 'template':
+            hovertemplate = hover_template(hover_data, hover_labels)
+    else:
+        hover_data = []
+
+    settings = dict(hover_data=hover_data, hover_mode=hover_mode,
+            hover_labels=hover_labels, hovertemplate=hovertemplate,
+            smoother=smoother, smoother_parameter=smoother_parameter,
+            point_budget=point_budget, extents=extents,
+            density_bins=density_bins,
+            density_values=size if size is not None and schema.is_continuous(size) else None,
+            ranges={k: subplot_ranges(fig, k[1]+1, k[0]+1, ranges) for k, _ in xys})
+
+    # one job per legend group and x variable, so the smoothing of the y
+    # variables sharing an x can be batched
+    rolled = aggregated = None
+    if df is None:
+        with metrics.stage('aggregate'):
+            groups, aggregated = backend_aggregates(source, filters, xys,
+                    color, symbol, aggregate, x_bin)
+    else:
+        with metrics.stage('grouping'):
+            groups = legend_groups(dfcolor, dfsymbol)
+
+    # moving averages of all groups are computed together, the Whittaker
+    # smoother runs per group in the jobs
+    if aggregated is not None:
+        pass
+    elif plot_mode != 'points' and groups:
+        with metrics.stage('aggregate'):
+            aggregated = aggregate_groups(df, groups, xys,
+                    'box' if plot_mode == 'box' else aggregate, x_bin)
+        if plot_mode == 'box':
+            fig.update_layout(boxmode='group')
+    elif smoother in ('moving-average', 'centered-average', 'time-average') and groups:
+        with metrics.stage('smoothing'):
+            rolled = rolling_groups(df, groups, xys, smoother, smoother_parameter)
+
+    jobs = []
+    for group, (ccounter, c, scounter, s, idx) in enumerate(groups):
+        name = (str(c) if c is not None and c is not True else '') +\
+               ('-' + str(s) if s is not None and s is not True else '')
+        size_array = dfsize.values[idx] if size is not None else None
+        for xinst in dict.fromkeys(xinst for _, (xinst, _) in xys):
+            pairs = [(i, xy) for i, xy in enumerate(xys) if xy[1][0] == xinst]
+            if aggregated is not None:
+                jobs.append((group, (aggregated[group], name, ccounter, scounter, pairs, plot_mode)))
                 continue
+            columns = [xinst] + [yinst for _, (_, (_, yinst)) in pairs] + hover_data
+            if settings['density_values'] is not None:
+                columns.append(size)
+            gr = df[list(dict.fromkeys(columns))].iloc[idx]
+            smoothed = None if rolled is None else {k: v for k, v in rolled[group].items() if k[0] == xinst}
+            jobs.append((group, (gr, size_array, name, ccounter, scounter, pairs, settings, smoothed)))
+
+    with metrics.stage('traces'):
+        if aggregated is not None: # a few points per trace, not worth a pool
+            results = [aggregate_traces(*job) for _, job in jobs]
+        elif executor is None:
+            results = [group_traces(*job) for _, job in jobs]
+        else:
+            # the hover and smoothing stages of pool threads are recorded
+            # into this request too, those of worker processes are lost
+            task = metrics.bind(group_traces) if isinstance(executor, ThreadPoolExecutor) else group_traces
+            results = list(executor.map(task, *zip(*(job for _, job in jobs))))
+
+    # traces in subplot order within each legend group, as if serial
+    with metrics.stage('assembly'):
+        traces = []
+        for group in dict.fromkeys(group for group, _ in jobs):
+            ordered = [trace for (g, _), result in zip(jobs, results)
+                    if g == group for trace in result]
+            ordered.sort(key=lambda trace: trace[0])
+            traces += ordered
+        fig = (assemble_validated if validate else assemble)(fig, xys, traces)
+    metrics.record('trace_count', len(fig.data))
+
+    return fig
+
+
+def assemble(grid, xys, traces):
+    """
+    Figure of the traces on the subplot grid, built in one step.
+
+    The axis titles go into the layout of the grid and every trace becomes
+    a plain dict referencing the axes of its subplot, so the figure is
+    constructed without validating any property: the trace properties
+    are those of group_traces, known to be valid, and the layout was
+    validated by make_subplots. Trace arrays are converted to numpy arrays
+    as validation would.
+
+    Inputs:
+      grid: figure made by make_subplots, without traces
+      xys: sequence of ((xcounter, ycounter), (x, y)) of the subplots
+      traces: sequence of (position, row, col, trace type, trace keyword
+        arguments) as returned by group_traces, in figure order
+    Outputs:
+      the figure, which keeps the grid of the subplots
+    """
+    layout = grid.layout.to_plotly_json()
+    axes = {}
+    for (xcounter, ycounter), (xinst, yinst) in xys:
+        subplot = grid.get_subplot(1+ycounter, 1+xcounter)
+        xname, yname = subplot.xaxis.plotly_name, subplot.yaxis.plotly_name
+        layout[xname]['title'] = dict(text=xinst)
+        layout[yname]['title'] = dict(text=yinst)
+        axes[1+ycounter, 1+xcounter] = 'x' + xname[5:], 'y' + yname[5:]
+
+    data = []
+    for _, row, col, kind, kwargs in traces:
+        trace = dict(type=kind)
+        for k, v in kwargs.items():
+            if v is None:
+                continue
+            if k == 'marker':
+                v = {mk: trace_array(mv) for mk, mv in v.items() if mv is not None}
+            trace[k] = trace_array(v)
+        trace['xaxis'], trace['yaxis'] = axes[row, col]
+        data.append(trace)
+
+    return go.Figure(dict(data=data, layout=layout, _grid_ref=grid._grid_ref,
+        _grid_str=grid._grid_str), _validate=False)
+
+
+def assemble_validated(grid, xys, traces):
+    """
+    assemble through the validating go.Figure API, a trace at a time: the
+    reference assemble must give the same figure as.
+    """
+    fig = go.Figure(grid)
+    for (xcounter, ycounter), (xinst, yinst) in xys:
+        fig.update_xaxes(title_text=xinst, row=1+ycounter, col=1+xcounter)
+        fig.update_yaxes(title_text=yinst, row=1+ycounter, col=1+xcounter)
+    for _, row, col, kind, kwargs in traces:
+        fig.add_trace(dict(type=kind, **{k: v for k, v in kwargs.items() if v is not None}),
+                row=row, col=col)
+    return fig
 
-            gr = df[bl]
-            name = (str(c) if c is not None and c is not True else '') +\
-                   ('-' + str(s) if s is not None and s is not True else '')
 
-            if size is not None:
-                size_array = dfsize[bl]
+def trace_array(value):
+    """
+    Series and arrays as read-only numpy arrays, as validation stores
+    them, without copying: a read-only view of the values, the values
+    themselves staying writeable. Other values are unchanged.
+    """
+    if isinstance(value, (pd.Series, pd.Index, np.ndarray)):
+        value = np.asarray(value).view()
+        value.flags.writeable = False
+    return value
+
+
+def group_traces(gr, size_array, name, ccounter, scounter, pairs, settings, smoothed=None):
+    """
+    Trace data of one legend group for the subplots sharing one x variable.
+
+    Module level and free of the figure, so it can run in a thread or
+    process pool.
+
+    Inputs:
+      gr: data frame of the group rows
+      size_array: marker sizes of the group rows, or None
+      name: legend group name
+      ccounter, scounter: color and symbol counters of the group
+      pairs: sequence of (position, ((xcounter, ycounter), (x, y))) of the
+        subplots, position being the subplot index in the figure
+      settings: dict of the fig_updater options
+      smoothed: smoothed lines computed beforehand (see rolling_groups),
+        None to smooth the group here (see smooth_group)
+    Outputs:
+      list of (position, row, col, trace type, trace keyword arguments)
+    """
+
+    hover_data = settings['hover_data']
+    hovertext_array = customdata_array = None
+    if hover_data:
+        with metrics.stage('hover'):
+            if settings['hover_mode'] == 'template':
+                customdata_array = hover_customdata(gr, hover_data)
             else:
-                size_array = None
-
-            marker_array = dict(color=color_cycle[ccounter % ncolors],
-            symbol=scounter,
-            size=size_array)
-
-            # hovertext must be sequence
-            if hover_data is not None:
-                hovertext_array = []
-                for hii, hi in gr[list(hover_data)].iterrows(): # allow passing tuples
-                    hr = []
-                    for hvt in hover_data:
-                        hr.append(f'{hvt}: {hi[hvt]}')
-                    hovertext_array.append('\n\n'.join(hr))
+                hovertext_array = hover_text(gr, hover_data, settings['hover_labels'])
+
+    point_budget = settings['point_budget']
+    density_bins = settings['density_bins']
+    color = color_cycle[ccounter % ncolors]
+    if smoothed is None:
+        with metrics.stage('smoothing'):
+            smoothed = smooth_group(gr, [xy for _, xy in pairs],
+                    settings['smoother'], settings['smoother_parameter'])
+
+    traces = []
+    for position, ((xcounter, ycounter), (xinst, yinst)) in pairs:
+        row, col = ycounter+1, xcounter+1
+        xrange, yrange = settings['ranges'][xcounter, ycounter]
+        if (xcounter, ycounter) in settings['extents']:
+            xe, ye = settings['extents'][xcounter, ycounter]
+            if settings['density_values'] is not None:
+                values = gr[settings['density_values']].values
+            else:
+                values = None
+            z = bin2d(gr[xinst].values, gr[yinst].values, xe, ye, density_bins, values)
+            traces.append((position, row, col, 'heatmap', dict(
+                    x=centers(gr[xinst].values, xe, density_bins[0]),
+                    y=centers(gr[yinst].values, ye, density_bins[1]),
+                    z=z,
+                    name=name + '-' + xinst + '-' + yinst,
+                    colorscale=colorscale(color),
+                    showscale=False,
+                    hoverongaps=False)))
+        else:
+            if point_budget is not None or xrange is not None or yrange is not None:
+                sel = select_markers(gr[xinst].values, gr[yinst].values,
+                        point_budget, xrange, yrange)
             else:
-                hovertext_array = None
-
-            for (xcounter, ycounter), (xinst, yinst) in xys:
-                fig.update_yaxes(title_text=yinst,
-                        row=1+ycounter,
-                        col=1+xcounter)
-                fig.update_xaxes(title_text=xinst,
-                        row=1+ycounter,
-                        col=1+xcounter)
-                trace = go.Scattergl(x=gr[xinst],
-                        y=gr[yinst],
-                        mode='markers',
-                        name=name + '-' + xinst + '-' + yinst,
-                        hovertext=hovertext_array,
-                        marker=marker_array)
-                fig.add_trace(trace, row=ycounter+1, col=xcounter+1)
-
-                gr = gr.sort_values(by=xinst)
-                if smoother == 'whittaker':
-                    y2 = whittaker_smooth(gr[yinst].values, 10**smoother_parameter) # input is a linear range of 0 to 5
-                elif smoother == 'moving-average':
-                    y2 = gr[yinst].rolling(window=smoother_parameter, center=False).mean()
-                else:
-                    continue
-
-                trace = go.Scattergl(x=gr[xinst],
-                        y=y2,
-                        mode='lines',
-                        name=name + '-' + xinst + '-' + yinst + '-smooth',
-                        hovertext=None,
-                        marker=dict(color=color_cycle[ccounter % ncolors]))
-                fig.add_trace(trace, row=ycounter+1, col=xcounter+1)
+                sel = None
+
+            traces.append((position, row, col, 'scattergl', dict(
+                    x=take(gr[xinst], sel),
+                    y=take(gr[yinst], sel),
+                    mode='markers',
+                    name=name + '-' + xinst + '-' + yinst,
+                    hovertext=take(hovertext_array, sel),
+                    customdata=take(customdata_array, sel),
+                    hovertemplate=settings['hovertemplate'],
+                    marker=dict(color=color,
+                        symbol=scounter,
+                        size=take(size_array, sel)))))
+
+        if (xinst, yinst) not in smoothed:
+            continue
+        xsorted, y2 = smoothed[xinst, yinst]
+        if point_budget is not None or xrange is not None:
+            sel = select_line(xsorted.values, np.asarray(y2), point_budget, xrange)
+        else:
+            sel = None
 
-    return fig
+        traces.append((position, row, col, 'scattergl', dict(
+                x=take(xsorted, sel),
+                y=take(y2, sel),
+                mode='lines',
+                name=name + '-' + xinst + '-' + yinst + '-smooth',
+                hovertext=None,
+                marker=dict(color=color))))
+
+    return traces
+
+
+def aggregate_traces(aggregated, name, ccounter, scounter, pairs, plot_mode):
+    """
+    Bar, line or box traces of the aggregates of one legend group for the
+    subplots sharing one x variable.
+
+    Inputs:
+      aggregated: dict of the group as returned by aggregate_groups
+      name, ccounter, scounter, pairs: see group_traces
+      plot_mode: 'bar', 'line' or 'box'
+    Outputs:
+      list of (position, row, col, trace type, trace keyword arguments)
+    """
+
+    color = color_cycle[ccounter % ncolors]
+    traces = []
+    for position, ((xcounter, ycounter), (xinst, yinst)) in pairs:
+        x, stats = aggregated[xinst, yinst]
+        trace = dict(x=x, name=name + '-' + xinst + '-' + yinst)
+        if plot_mode == 'bar':
+            kind = 'bar'
+            trace.update(y=stats['y'], marker=dict(color=color))
+        elif plot_mode == 'line':
+            kind = 'scattergl'
+            trace.update(y=stats['y'], mode='lines+markers',
+                    marker=dict(color=color, symbol=scounter))
+        else:
+            kind = 'box'
+            trace.update(stats, boxmean=True, marker=dict(color=color))
+        traces.append((position, ycounter+1, xcounter+1, kind, trace))
+    return traces
+
+
+def make_executor(kind=None, max_workers=None):
+    """
+    Executor for fig_updater: 'thread', 'process', or None for serial.
+    """
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers=max_workers)
+    elif kind == 'process':
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return None
+
+
+def subplot_ranges(fig, row, col, ranges):
+    """
+    Visible (x range, y range) of a subplot from the axis ranges, following
+    shared axes to the axis they match. Either is None when autoranged.
+    """
+
+    if not ranges:
+        return None, None
+
+    def shared(name):
+        matches = fig.layout[name].matches
+        return name if matches is None else matches[0] + 'axis' + matches[1:]
+
+    groups = {shared(name): r for name, r in ranges.items() if name in fig.layout}
+    subplot = fig.get_subplot(row, col)
+    return (groups.get(shared(subplot.xaxis.plotly_name)),
+            groups.get(shared(subplot.yaxis.plotly_name)))
+
+
+def smooth_group(gr, xys, smoother, smoother_parameter):
+    """
+    Whittaker smoothed lines of a legend group for every subplot (x, y)
+    pair, moving averages being computed for all groups by rolling_groups.
+
+    The group is sorted once per x variable and every y variable sharing
+    that x is smoothed in one batch.
+    Returns a dict mapping (x, y) labels to (sorted x, smoothed y).
+    """
 
+    if smoother != 'whittaker':
+        return {}
 
+    smoothed = {}
+    xinsts = dict.fromkeys(xinst for _, (xinst, _) in xys)
+    for xinst in xinsts:
+        yinsts = list(dict.fromkeys(yinst for _, (xi, yinst) in xys if xi == xinst))
+        grs = gr.sort_values(by=xinst, kind='stable')
+        xsorted = grs[xinst]
+        # input is a linear range of 0 to 5
+        positions = xsorted.values if xsorted.dtype.kind in 'iufM' else None
+        y2s = whittaker_smooth_batch(grs[yinsts].values, 10**smoother_parameter, positions)
+        for i, yinst in enumerate(yinsts):
+            smoothed[xinst, yinst] = xsorted, y2s[:, i]
+    return smoothed
 
-def cont2disc(series, ncategories=5):
+
+def rolling_groups(df, groups, xys, smoother, smoother_parameter):
+    """
+    Moving averages of every legend group, in one sorted pass over the
+    rows of all groups per x variable (see grouping.rolling_mean).
+
+    'moving-average' averages over smoother_parameter rows ending at each
+    point, 'centered-average' over as many rows centered on it and
+    'time-average' over an x distance of smoother_parameter ending at it
+    (days for datetime x, rows for categorical x). Missing values are left
+    out. As with pandas rolling, windows of a count of rows are NaN until
+    they span that many rows.
+    Returns a list with a dict per group as returned by smooth_group.
+    """
+
+    positions = np.concatenate([idx for *_, idx in groups])
+    lengths = [len(idx) for *_, idx in groups]
+    codes = np.repeat(np.arange(len(groups)), lengths)
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+
+    smoothed = [{} for _ in groups]
+    xinsts = dict.fromkeys(xinst for _, (xinst, _) in xys)
+    for xinst in xinsts:
+        yinsts = list(dict.fromkeys(yinst for _, (xi, yinst) in xys if xi == xinst))
+        xcol = df[xinst].iloc[positions]
+        x = sortable(xcol.values)
+        order = np.lexsort((x, codes)) # stable, by group then x
+        kind = xcol.dtype.kind
+        if smoother != 'time-average' or kind not in 'iufM':
+            window = int(smoother_parameter)
+        elif kind == 'M':
+            window = pd.Timedelta(days=smoother_parameter)
+        else:
+            window = float(smoother_parameter)
+        means = rolling_mean(codes[order], x[order],
+                df[yinsts].values[positions[order]], window,
+                center=smoother == 'centered-average')
+        xsorted = xcol.iloc[order]
+        for group in range(len(groups)):
+            rows = slice(bounds[group], bounds[group + 1])
+            for i, yinst in enumerate(yinsts):
+                smoothed[group][xinst, yinst] = xsorted.iloc[rows], means[rows, i]
+    return smoothed
+
+
+def aggregate_groups(df, groups, xys, how='sum', x_bin=None):
+    """
+    Aggregates of y per legend group and x bin for every subplot, in one
+    sorted pass over the rows of all groups per x variable (see
+    grouping.group_aggregate), so traces carry a point per bin instead of
+    a point per row.
+
+    Returns a list with a dict per group mapping (x, y) labels to (x bins,
+    dict of the aggregates of y), as returned by group_aggregate.
+    """
+
+    positions = np.concatenate([idx for *_, idx in groups])
+    codes = np.repeat(np.arange(len(groups)), [len(idx) for *_, idx in groups])
+
+    aggregated = [{} for _ in groups]
+    xinsts = dict.fromkeys(xinst for _, (xinst, _) in xys)
+    for xinst in xinsts:
+        yinsts = list(dict.fromkeys(yinst for _, (xi, yinst) in xys if xi == xinst))
+        xbins = bin_values(df[xinst].values[positions], x_bin)
+        first, stats = group_aggregate(codes, sortable(xbins),
+                df[yinsts].values[positions], how)
+        bounds = np.searchsorted(codes[first], np.arange(len(groups) + 1))
+        for group in range(len(groups)):
+            rows = slice(bounds[group], bounds[group + 1])
+            for i, yinst in enumerate(yinsts):
+                aggregated[group][xinst, yinst] = (xbins[first[rows]],
+                        {k: v[rows, i] for k, v in stats.items()})
+    return aggregated
+
+
+def aggregated_by_backend(schema, ys, color, symbol, plot_mode, aggregate):
+    """
+    Whether the backend can group the aggregates of the figure (see
+    backend_aggregates): bar and line aggregations of the backends (see
+    grouping.backend_aggregations) of continuous y, with discrete or no
+    color and symbol, which aren't binned into quantiles.
+    """
+    return (plot_mode in ('bar', 'line') and aggregate in backend_aggregations and
+            all(schema.is_continuous(y) for y in ys) and
+            all(col is None or schema.is_discrete(col) for col in (color, symbol)))
+
+
+def backend_aggregates(source, filters, xys, color=None, symbol=None, how='sum',
+        x_bin=None, min_rows=2):
+    """
+    Legend groups and aggregates of y per legend group and x bin for every
+    subplot, as given by legend_groups and aggregate_groups, grouped by the
+    backend (see backend.FrameBackend.aggregate) so no row is read. The
+    groups have no row positions.
+    """
+
+    roles = dict(color=color, symbol=symbol)
+    by = [col for col in roles.values() if col is not None]
+    # aggregate columns of the roles given
+    keys = {role: f'k{i}' for i, role in enumerate(r for r, col in roles.items() if col is not None)}
+
+    # levels numbered in order of appearance, as by legend_groups: the
+    # (color, symbol) pairs in the order of their first rows
+    counts = source.aggregate(None, [], by, 'count', None, filters)
+    counts = counts.sort_values('first', kind='stable')
+    codes, levels = [], []
+    for role in ('color', 'symbol'):
+        if role in keys:
+            c, uniq = pd.factorize(counts[keys[role]], use_na_sentinel=False)
+            codes.append(c)
+            levels.append((pd.isna(uniq), uniq.tolist()))
+        else:
+            codes.append(np.zeros(len(counts), dtype=np.int64))
+            levels.append(([False], [True]))
+    (cmissing, cuniq), (smissing, suniq) = levels
+
+    groups = []
+    for ccounter, scounter, rows in sorted(zip(codes[0].tolist(), codes[1].tolist(),
+            counts['rows'].tolist())):
+        if rows < min_rows or cmissing[ccounter] or smissing[scounter]:
+            continue
+        groups.append((ccounter, cuniq[ccounter], scounter, suniq[scounter], None))
+    number = {(c, s): group for group, (_, c, _, s, _) in enumerate(groups)}
+
+    aggregated = [{} for _ in groups]
+    for xinst in dict.fromkeys(xinst for _, (xinst, _) in xys):
+        yinsts = list(dict.fromkeys(yinst for _, (xi, yinst) in xys if xi == xinst))
+        frame = source.aggregate(xinst, yinsts, by, how, x_bin, filters)
+        cs = frame[keys['color']].tolist() if 'color' in keys else [True] * len(frame)
+        ss = frame[keys['symbol']].tolist() if 'symbol' in keys else [True] * len(frame)
+        # bins of a group are together and sorted by x
+        group_codes = np.array([number.get(pair, -1) for pair in zip(cs, ss)], dtype=np.int64)
+        order = np.argsort(group_codes, kind='stable')
+        bounds = np.searchsorted(group_codes[order], np.arange(len(groups) + 1))
+        x = frame['x'].to_numpy()
+        for group in range(len(groups)):
+            rows = order[bounds[group]:bounds[group + 1]]
+            for i, yinst in enumerate(yinsts):
+                aggregated[group][xinst, yinst] = (x[rows],
+                        dict(y=frame[f'y{i}'].to_numpy()[rows]))
+    return groups, aggregated
+
+
+def quantiles(stats, column, ncategories=5):
+    if stats is None:
+        return None
+    return stats.quantiles(column, np.linspace(0, 1, ncategories))
+
+
+def cont2disc(series, ncategories=5, q=None):
     """
     Converts continuous into intervals to be treated as discrete (intervals represented as strings).
+    The quantile bin edges q are computed when not given.
     """
-    q = series.quantile(np.linspace(0, 1, ncategories))
+    if q is None:
+        q = series.quantile(np.linspace(0, 1, ncategories))
     return pd.cut(series, pd.unique(q)).astype(str)
 
 
@@ -198,7 +692,7 @@ def disc2cont(series):
     """
     Converts discrete (str or other) to continuous numeric in interval [0, 1].
     """
-    return series.map(dict(zip(series.unique(), np.linspace(0, 1, series.nunique()))))
+    return series.map(dict(zip(series.unique(), np.linspace(0, 1, series.nunique())))).astype(float)
 
 if __name__ == '__main__':
     x1 = 'dateRep'
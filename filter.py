@@ -8,31 +8,42 @@ import dash_core_components as dcc
 import dash_html_components as html
 import pandas as pd
 from dash.dependencies import Input, Output, State, MATCH, ALL
-from data import df, options, types
+import backend
 
-def assign_filter(app):
+def filter_widgets(index, field=None, lb=None, ub=None):
+    return html.Div(children=[dcc.Dropdown(
+        id={'type': 'filter-dropdown', 'index': index},
+        options=backend.current().options, value=field),
+        dcc.Input(id={'type': 'filter-lb', 'index': index}, value=lb),
+        dcc.Input(id={'type': 'filter-ub', 'index': index}, value=ub),
+        html.Datalist(id={'type': 'filter-discrete-list', 'index': index}),
+        html.Button('Update', id={'type': 'filter-update', 'index': index}),
+        html.Button('Delete', id={'type': 'filter-delete', 'index': index}),
+        html.P('', id={'type': 'filter-description', 'index': index})
+    ], id={'type': 'filter-container', 'index': index})
+
+
+def assign_filter(app, sessions):
 
     @app.callback(
         Output('dropdown-container', 'children'),
-        [Input('add-filter', 'n_clicks')],
+        [Input('add-filter', 'n_clicks'),
+         Input('session-key', 'data')],
         [State('dropdown-container', 'children')])
-    def add_filter(n_clicks, children):
-        new_dropdown = html.Div(children=[dcc.Dropdown(
-            id={'type': 'filter-dropdown', 'index': n_clicks},
-            options=options), 
-            dcc.Input(id={'type': 'filter-lb', 'index': n_clicks}), 
-            dcc.Input(id={'type': 'filter-ub', 'index': n_clicks}), 
-            html.Datalist(id={'type': 'filter-discrete-list', 'index': n_clicks}), 
-            html.Button('Update', id={'type': 'filter-update', 'index': n_clicks}), 
-            html.Button('Delete', id={'type': 'filter-delete', 'index': n_clicks}),
-            html.P('', id={'type': 'filter-description', 'index': n_clicks})
-        ], id={'type': 'filter-container', 'index': n_clicks})
-        children.append(new_dropdown)
+    def add_filter(n_clicks, key, children):
+        if dash.callback_context.triggered_id != 'add-filter':
+            # page load or a session opened, show the filters it last applied
+            children = [] if key is None else [filter_widgets(f'saved-{i}', *f)
+                    for i, f in enumerate(sessions.get(key)['filters'])]
+            if children:
+                return children
+        children.append(filter_widgets(n_clicks))
         return children
 
 
     @app.callback(
         [Output({'type': 'filter-lb', 'index': MATCH}, 'list'),
+         Output({'type': 'filter-discrete-list', 'index': MATCH}, 'children'),
          Output({'type': 'filter-ub', 'index': MATCH}, 'disabled'),
          Output({'type': 'filter-description', 'index':MATCH}, 'children')],
         [Input({'type': 'filter-dropdown', 'index': MATCH}, 'value')]
@@ -40,10 +51,21 @@ def assign_filter(app):
     def change_type(dropdown):
         if dropdown is None:
             return dash.no_update
-        elif types[dropdown] == 'continuous':
-            return dropdown, False, 'quantiles: ' + str(df[dropdown].quantile(np.linspace(0, 1, 6))).replace('    ',':').replace('\n', ',')
+        source = backend.current()
+        stats = source.stats
+        # only suggest for those with a small number of options
+        uniq = stats.uniques(dropdown, limit=14)
+        if uniq is None:
+            dlist, suggestions = None, []
+        else:
+            index = dash.callback_context.outputs_list[0]['id']['index']
+            dlist, suggestions = datalist_id(index), [html.Option(x) for x in uniq]
+        if source.schema.is_continuous(dropdown):
+            q = stats.quantiles(dropdown, np.linspace(0, 1, 6))
+            return dlist, suggestions, False, 'quantiles: ' + str(q).replace('    ',':').replace('\n', ',')
         else:  # change to discrete
-            return dropdown, True, 'unique values: ' + str(df[dropdown].unique())[:50] 
+            uniq = stats.uniques(dropdown) if uniq is None else uniq
+            return dlist, suggestions, True, 'unique values: ' + str(uniq)[:50] 
 
 
     @app.callback(
@@ -55,22 +77,36 @@ def assign_filter(app):
 
     return app
 
+import json
 import numpy as np
 
-def apply_filter(fields, lbs, ubs):
+def datalist_id(index):
+    """
+    DOM id of the datalist of a filter, a dict id serialized as by Dash.
+    """
+    return json.dumps({'type': 'filter-discrete-list', 'index': index},
+            sort_keys=True, separators=(',', ':'))
+
+
+def describe_filters(fields, lbs, ubs):
+    """
+    Description of the filters for the current-filters history.
+    """
     st = ''
-    bls = []
     for i in range(len(fields)):
         st += f'{i} {fields[i]} {lbs[i]} {ubs[i]}\n'
-        if types[fields[i]] == 'continuous':
-            bls.append((df[fields[i]] > float(lbs[i])) & (df[fields[i]] < float(ubs[i])))
-        else:
-            eqs = tuple(i.strip() for i in lbs[i].split(','))
-            bls.append(df[fields[i]].isin(eqs))
+    return st
 
-    gbl = np.all(bls, axis=0)
 
-    return gbl, st
+def apply_filter(fields, lbs, ubs, columns=None, source=None):
+    """
+    Rows passing every filter, with the given columns (all by default),
+    read from the current backend (see backend.current) unless a backend
+    is given, and a description of the filters.
+    """
+    source = source or backend.current()
+    columns = list(source.schema.roles) if columns is None else columns
+    return source.query(columns, list(zip(fields, lbs, ubs))), describe_filters(fields, lbs, ubs)
 
 
 if __name__ == '__main__':
@@ -90,6 +126,7 @@ if __name__ == '__main__':
                 st += f'{i} {fields[i]} {lbs[i]} {ubs[i]}\n'
         return st
     from layouts import filtering_layout
+    from session import SessionStore
     app.layout = filtering_layout
-    app = assign_filter(app)
+    app = assign_filter(app, SessionStore())
     app.run_server(debug=True)
@@ -0,0 +1,120 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+from cache import LRUCache
+
+class FilterEngine:
+    """
+    Evaluates filters on a fixed data frame.
+
+    Continuous columns get a sorted index on first use, so range filters
+    are two binary searches. Discrete columns are factorized on first use,
+    so set filters are a lookup on integer codes. The mask of every filter
+    is cached, and so is the AND of all filters but one, so changing one
+    filter costs its own mask and a single AND.
+    """
+
+    def __init__(self, df, schema, maxsize=64):
+        self.df = df
+        self.schema = schema
+        self._sorted = {}
+        self._codes = {}
+        self._masks = LRUCache(maxsize)
+        self._combined = LRUCache(maxsize)
+
+    def sorted_index(self, field):
+        """
+        Row order sorting the column (missing values last) and the sorted values.
+        """
+        if field not in self._sorted:
+            values = self.df[field].to_numpy()
+            order = np.argsort(values, kind='stable')
+            self._sorted[field] = order, values[order]
+        return self._sorted[field]
+
+    def codes(self, field):
+        """
+        Integer codes of the column (-1 for missing) and the levels they index.
+        """
+        if field not in self._codes:
+            self._codes[field] = pd.factorize(self.df[field])
+        return self._codes[field]
+
+    def parse_bound(self, field, bound):
+        if self.df[field].dtype.kind == 'M':
+            return np.datetime64(pd.Timestamp(bound))
+        return float(bound)
+
+    def range_mask(self, field, lb, ub):
+        """
+        Rows strictly between lb and ub.
+        """
+        order, values = self.sorted_index(field)
+        start = np.searchsorted(values, self.parse_bound(field, lb), side='right')
+        stop = np.searchsorted(values, self.parse_bound(field, ub), side='left')
+        bl = np.zeros(len(values), dtype=bool)
+        bl[order[start:max(start, stop)]] = True
+        return bl
+
+    def isin_mask(self, field, eqs):
+        """
+        Rows whose value is one of eqs.
+        """
+        codes, uniques = self.codes(field)
+        # the extra False is looked up by the missing value code -1
+        lookup = np.append(np.asarray(uniques.isin(eqs)), False)
+        return lookup[codes]
+
+    def mask(self, field, lb, ub):
+        key = (field, lb, ub)
+        bl = self._masks.get(key)
+        if bl is None:
+            if self.schema.is_continuous(field):
+                bl = self.range_mask(field, lb, ub)
+            else:
+                bl = self.isin_mask(field, tuple(i.strip() for i in lb.split(',')))
+            self._masks.put(key, bl)
+        return bl
+
+    def apply(self, fields, lbs, ubs):
+        """
+        Rows passing all filters, as a read-only boolean array.
+        """
+        filters = list(zip(fields, lbs, ubs))
+        key = tuple(sorted(filters, key=str))
+        gbl = self._combined.get(key)
+        if gbl is not None:
+            return gbl
+        # the filter being edited is one whose others were ANDed before
+        for field, lb, ub in filters:
+            rest = self._combined.peek(key_without(key, (field, lb, ub)))
+            if rest is not None:
+                return self._store(key, rest & self.mask(field, lb, ub))
+        # otherwise every AND of all filters but one is kept for the next
+        # edit, from the ANDs of the filters before and after it
+        masks = [self.mask(*f) for f in filters]
+        before = [np.ones(len(self.df), dtype=bool)]
+        for bl in masks[:-1]:
+            before.append(before[-1] & bl)
+        after = np.ones(len(self.df), dtype=bool)
+        for i in reversed(range(len(filters))):
+            self._store(key_without(key, filters[i]), before[i] & after)
+            after = after & masks[i]
+        return self._store(key, after)
+
+    def _store(self, key, gbl):
+        gbl.flags.writeable = False
+        self._combined.put(key, gbl)
+        return gbl
+
+
+def key_without(key, f):
+    """
+    Key of the filters of key but one occurrence of f.
+    """
+    i = key.index(f)
+    return key[:i] + key[i + 1:]
@@ -0,0 +1,276 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+
+def legend_groups(dfcolor, dfsymbol, min_rows=2):
+    """
+    Split row positions into legend groups in a single pass.
+
+    Color and symbol are factorized once (levels in order of appearance, as
+    with Series.unique) and the combined codes are stably sorted, so every
+    group gets its row positions without rescanning the frame. Groups whose
+    level is missing (NaN) never match and groups with fewer than min_rows
+    rows are skipped.
+
+    Inputs:
+      dfcolor: series of color levels
+      dfsymbol: series of symbol levels, aligned with dfcolor
+      min_rows: smallest group size returned
+    Outputs:
+      list of (ccounter, c, scounter, s, positions) in color-major order,
+      where the counters index the levels in order of appearance
+    """
+
+    ccodes, cuniq = pd.factorize(dfcolor, use_na_sentinel=False)
+    scodes, suniq = pd.factorize(dfsymbol, use_na_sentinel=False)
+    nsymbols = len(suniq)
+
+    codes = ccodes.astype(np.int64) * nsymbols + scodes
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes, minlength=len(cuniq) * nsymbols)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+
+    cmissing = pd.isna(cuniq)
+    smissing = pd.isna(suniq)
+    cuniq = cuniq.tolist()
+    suniq = suniq.tolist()
+
+    groups = []
+    for code in np.flatnonzero(counts >= min_rows):
+        ccounter, scounter = divmod(int(code), nsymbols)
+        if cmissing[ccounter] or smissing[scounter]:
+            continue
+        groups.append((ccounter, cuniq[ccounter], scounter, suniq[scounter],
+            order[bounds[code]:bounds[code + 1]]))
+    return groups
+
+
+def sortable(values):
+    """
+    Values as floats ordered like the values, datetimes as nanoseconds and
+    missing values as NaN. Other values (strings, categories) are ranked.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        ns = values.astype('datetime64[ns]')
+        out = ns.astype(np.int64).astype(float)
+        out[np.isnat(ns)] = np.nan
+        return out
+    elif values.dtype.kind in 'iufb':
+        return values.astype(float)
+    codes, _ = pd.factorize(values, sort=True)
+    return np.where(codes < 0, np.nan, codes).astype(float)
+
+
+def group_searchsorted(codes, values, qcodes, qvalues, side='left'):
+    """
+    Insertion points of the (qcode, qvalue) pairs into the rows sorted by
+    (code, value), comparing pairs lexicographically, as np.searchsorted
+    would with a composite key. Elements and queries are merged in one
+    stable lexsort, ties put queries before (side 'left') or after (side
+    'right') equal elements.
+    """
+    n = len(codes)
+    isquery = np.concatenate((np.zeros(n, dtype=np.int8), np.ones(len(qcodes), dtype=np.int8)))
+    tie = isquery if side == 'right' else 1 - isquery
+    order = np.lexsort((tie, np.concatenate((values, qvalues)), np.concatenate((codes, qcodes))))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    queries_before = np.cumsum(isquery[order]) - 1
+    return rank[n:] - queries_before[rank[n:]]
+
+
+def window_bounds(codes, x, window, center=False):
+    """
+    [left, right) row bounds of the window of every row, the rows being
+    sorted by (code, x) and windows never crossing groups.
+
+    Inputs:
+      codes: integer group code of each row
+      x: float positions of the rows (see sortable)
+      window: int for a count of rows, otherwise a distance along x, a
+        float or, for datetimes converted by sortable, a pandas Timedelta
+        or timedelta string such as '7D'
+      center: False for trailing windows ending at the row, True for
+        windows centered on the row
+    Outputs:
+      (left, right) integer arrays
+    """
+    if isinstance(window, (int, np.integer)):
+        start = np.searchsorted(codes, codes, side='left')
+        stop = np.searchsorted(codes, codes, side='right')
+        i = np.arange(len(codes))
+        before = window // 2 if center else window - 1
+        return np.maximum(i - before, start), np.minimum(i - before + window, stop)
+    if isinstance(window, str):
+        window = pd.Timedelta(window).value
+    elif isinstance(window, pd.Timedelta):
+        window = window.value
+    window = float(window)
+    if center: # (x - w/2, x + w/2] as pandas centered time based windows
+        return (group_searchsorted(codes, x, codes, x - window / 2, 'right'),
+                group_searchsorted(codes, x, codes, x + window / 2, 'right'))
+    # (x - w, x] as pandas time based windows
+    return (group_searchsorted(codes, x, codes, x - window, 'right'),
+            group_searchsorted(codes, x, codes, x, 'right'))
+
+
+def rolling_mean(codes, x, Y, window, center=False):
+    """
+    Moving averages of the columns of Y within every group in one pass,
+    from cumulative sums over all rows. Missing values are left out of
+    the means, windows without values give NaN. Windows of a count of
+    rows give NaN until they span that many rows, at the ends of every
+    group, as pandas rolling does by default.
+
+    Inputs:
+      codes, x: group codes and positions of the rows, sorted by (code, x)
+      Y: values, one column per series
+      window, center: see window_bounds
+    Outputs:
+      means, same shape as Y
+    """
+    Y = np.asarray(Y, dtype=float)
+    finite = np.isfinite(Y)
+    zero = np.zeros((1,) + Y.shape[1:])
+    sums = np.concatenate((zero, np.cumsum(np.where(finite, Y, 0.), axis=0)))
+    counts = np.concatenate((zero, np.cumsum(finite, axis=0)))
+    left, right = window_bounds(codes, x, window, center)
+    n = counts[right] - counts[left]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums[right] - sums[left]) / n
+    means[n < 1] = np.nan
+    if isinstance(window, (int, np.integer)):
+        means[right - left < window] = np.nan
+    return means
+
+
+# datetimes are binned from a Monday, so that bins of whole weeks start
+# on Mondays (see bin_values)
+bin_origin = pd.Timestamp('1970-01-05')
+
+def bin_width(width, kind):
+    """
+    Width of the bins of values of the dtype kind, width given as for
+    bin_values: a positive number, of days for datetimes (a Timedelta).
+    None when the values aren't binned, which is also the case for
+    widths which aren't positive or can't be read.
+    """
+    if width is None or kind not in 'iufM':
+        return None
+    try:
+        width = float(width)
+    except (TypeError, ValueError):
+        return None
+    if not (np.isfinite(width) and width > 0):
+        return None
+    return pd.Timedelta(days=width) if kind == 'M' else width
+
+
+def bin_values(values, width=None):
+    """
+    Start of the bin of every value, for bins of the given width, a number
+    of days for datetimes, floored from bin_origin, and a number for
+    numbers, floored from 0. Other values, and every value when width is
+    None or not a valid width (see bin_width), are bins of their own.
+    """
+    values = np.asarray(values)
+    width = bin_width(width, values.dtype.kind)
+    if width is None:
+        return values
+    if isinstance(width, pd.Timedelta):
+        unit = np.datetime_data(values.dtype)[0]
+        origin = bin_origin.to_datetime64().astype(values.dtype)
+        step = width.to_timedelta64().astype(f'm8[{unit}]')
+        missing = np.isnat(values)
+        with np.errstate(invalid='ignore'):
+            bins = origin + (np.where(missing, origin, values) - origin) // step * step
+        bins[missing] = np.datetime64('NaT')
+        return bins
+    return np.floor(values / width) * width
+
+
+aggregations = ('sum', 'mean', 'count', 'min', 'max', 'median', 'box')
+# aggregations needing no sort of the values, grouped by the backends too
+# (see backend.FrameBackend.aggregate)
+backend_aggregations = ('sum', 'mean', 'count', 'min', 'max')
+
+def segment_quantile(sorted_values, starts, counts, q):
+    """
+    Quantile q (linear interpolation) of every segment of sorted_values
+    beginning at starts, of which the first counts values are not missing.
+    NaN for segments without values.
+    """
+    pos = starts + q * np.maximum(counts - 1, 0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    values = sorted_values[lo] + (pos - lo) * (sorted_values[hi] - sorted_values[lo])
+    return np.where(counts > 0, values, np.nan)
+
+
+def group_aggregate(codes, x, Y, how='sum'):
+    """
+    Aggregate of the columns of Y over the rows of every distinct
+    (code, x) pair, all pairs in one sorted pass. Rows with missing x are
+    left out, as are missing values of Y.
+
+    Inputs:
+      codes: integer group code of each row
+      x: float positions of the rows (see sortable), the bins
+      Y: values, one column per series
+      how: one of aggregations, 'box' for the statistics of a box plot
+    Outputs:
+      (first, stats): row of the first value of every pair, pairs being
+      sorted by (code, x), and a dict of arrays with a row per pair and
+      a column per series, 'y' for the aggregate and for 'box' q1,
+      median, q3, mean and the lower and upper fences (the most extreme
+      values within 1.5 interquartile ranges of the quartiles). Pairs
+      without values get 0 for 'sum' and 'count', NaN otherwise.
+    """
+    if how not in aggregations:
+        raise ValueError(f'unknown aggregation {how!r}')
+    Y = np.asarray(Y, dtype=float)
+    rows = np.flatnonzero(~np.isnan(x))
+    order = rows[np.lexsort((x[rows], codes[rows]))]
+    c, xs, Y = codes[order], x[order], Y[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (c[1:] != c[:-1]) | (xs[1:] != xs[:-1])
+    starts = np.flatnonzero(new)
+    if len(starts) == 0:
+        empty = np.empty((0,) + Y.shape[1:])
+        keys = ('q1', 'median', 'q3', 'mean', 'lowerfence', 'upperfence') if how == 'box' else ('y',)
+        return order, {k: empty for k in keys}
+
+    present = ~np.isnan(Y)
+    counts = np.add.reduceat(present, starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if how in ('sum', 'mean', 'count', 'box'):
+            sums = np.add.reduceat(np.where(present, Y, 0.), starts, axis=0)
+            mean = sums / np.where(counts > 0, counts, np.nan)
+            if how != 'box':
+                return order[starts], dict(y={'sum': sums, 'count': counts, 'mean': mean}[how])
+        if how == 'min':
+            return order[starts], dict(y=np.fmin.reduceat(Y, starts, axis=0))
+        if how == 'max':
+            return order[starts], dict(y=np.fmax.reduceat(Y, starts, axis=0))
+
+        # quantiles from the values sorted within every pair, missing last
+        segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(order))))
+        quartiles = (('median', .5),) if how == 'median' else (('q1', .25), ('median', .5), ('q3', .75))
+        qs = {name: np.empty(counts.shape) for name, _ in quartiles}
+        for j in range(Y.shape[1]):
+            sorted_values = Y[np.lexsort((Y[:, j], segment)), j]
+            for name, q in quartiles:
+                qs[name][:, j] = segment_quantile(sorted_values, starts, counts[:, j], q)
+        if how == 'median':
+            return order[starts], dict(y=qs['median'])
+        qs['mean'] = mean
+        iqr = qs['q3'] - qs['q1']
+        low, high = qs['q1'] - 1.5 * iqr, qs['q3'] + 1.5 * iqr
+        qs['lowerfence'] = np.fmin.reduceat(np.where(Y >= low[segment], Y, np.nan), starts, axis=0)
+        qs['upperfence'] = np.fmax.reduceat(np.where(Y <= high[segment], Y, np.nan), starts, axis=0)
+        return order[starts], qs
@@ -0,0 +1,77 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+date_format = '%Y-%m-%d'
+datetime_format = '%Y-%m-%d %H:%M:%S'
+float_format = '.6g'
+
+def format_datetimes(series):
+    """
+    Format a datetime series as strings, dropping the time of day when
+    every value is at midnight.
+    """
+    if (series.dropna().dt.normalize() == series.dropna()).all():
+        return series.dt.strftime(date_format)
+    return series.dt.strftime(datetime_format)
+
+
+def format_column(series):
+    """
+    Format a column as an object array of strings without a Python loop
+    over rows. Datetimes and floats are formatted the same way in
+    hovertext and customdata.
+    """
+    kind = series.dtype.kind
+    if kind == 'M':
+        return format_datetimes(series).fillna('NaT').to_numpy(dtype=object)
+    elif kind == 'f':
+        return np.char.mod('%' + float_format, series.to_numpy()).astype(object)
+    return series.astype(str).to_numpy(dtype=object)
+
+
+def hover_text(gr, hover_data, labels=None):
+    """
+    Build the hovertext sequence column-wise.
+
+    Inputs:
+      gr: data frame of the trace rows
+      hover_data: sequence of labels (column names)
+      labels: dict mapping column names to aliases
+    Outputs:
+      object array of one hover string per row
+    """
+    labels = labels or {}
+    text = None
+    for hvt in hover_data:
+        column = labels.get(hvt, hvt) + ': ' + format_column(gr[hvt])
+        text = column if text is None else text + '<br>' + column
+    return text
+
+
+def hover_customdata(gr, hover_data):
+    """
+    Hover columns to send once as customdata, formatted as by format_column
+    so that the array holds only strings (see serialize.compact_figure).
+    """
+    return np.column_stack([format_column(gr[hvt]) for hvt in hover_data])
+
+
+def hover_template(hover_data, labels=None):
+    """
+    Hovertemplate referencing the columns of hover_customdata.
+
+    Inputs:
+      hover_data: sequence of labels (column names)
+      labels: dict mapping column names to aliases
+    Outputs:
+      hovertemplate string
+    """
+    labels = labels or {}
+    hr = ['(%{x}, %{y})']
+    for i, hvt in enumerate(hover_data):
+        hr.append(f'{labels.get(hvt, hvt)}: %{{customdata[{i}]}}')
+    return '<br>'.join(hr)
@@ -0,0 +1,152 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import nullcontext
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class Metrics:
+    """
+    Opt-in timings and counts of the stages of a figure update.
+
+    Stage wall times (seconds) and recorded values (rows, traces, bytes)
+    are kept in rolling windows of the last window samples. Requests
+    slower than slow_threshold seconds are logged with their stages.
+    When disabled, stage() returns a shared no-op context manager and
+    record() returns at once.
+    """
+
+    def __init__(self, enabled=False, window=1000, slow_threshold=None):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._samples[name].append(value)
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current[name] = current.get(name, 0) + value
+
+    def stage(self, name):
+        """
+        Context manager recording the wall time of the block as name.
+        """
+        if not self.enabled:
+            return _null
+        return _Stage(self, name)
+
+    def request(self, name='request'):
+        """
+        Context manager around a whole request: records its wall time and
+        logs the stages of the request when it is slow.
+        """
+        if not self.enabled:
+            return _null
+        return _Request(self, name)
+
+    def bind(self, f):
+        """
+        f recording into the request of the calling thread (see request)
+        whichever thread calls it, e.g. a pool thread running a job for
+        the request.
+        """
+        request = getattr(self._local, 'request', None)
+        if request is None:
+            return f
+        def bound(*args, **kwargs):
+            previous = getattr(self._local, 'request', None)
+            self._local.request = request
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._local.request = previous
+        return bound
+
+    def summary(self):
+        """
+        Count, mean, max and 50/90/99th percentiles per stage or value.
+        """
+        with self._lock:
+            samples = {k: np.array(v, dtype=float) for k, v in self._samples.items()}
+        summary = {}
+        for name, v in samples.items():
+            if len(v) == 0:
+                continue
+            p50, p90, p99 = np.percentile(v, [50, 90, 99])
+            summary[name] = dict(count=len(v), mean=v.mean(), max=v.max(),
+                    p50=p50, p90=p90, p99=p99)
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class _Stage:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _Request(_Stage):
+
+    def __enter__(self):
+        self.metrics._local.request = {}
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stages = self.metrics._local.request
+        self.metrics._local.request = None
+        self.metrics.record(self.name, elapsed)
+        threshold = self.metrics.slow_threshold
+        if threshold is not None and elapsed > threshold:
+            logger.warning('slow %s %.3fs %s', self.name, elapsed,
+                    ' '.join(f'{k}={v:.4g}' for k, v in stages.items()))
+        return False
+
+
+_null = nullcontext()
+
+def register_metrics_route(server, metrics, path='/metrics', caches=None):
+    """
+    Serve the metrics summary as JSON on a route of the Flask server, with
+    the info() (hits, misses, sizes) of the caches, a dict of name to cache.
+    """
+    from flask import jsonify
+
+    @server.route(path)
+    def metrics_summary():
+        return jsonify(enabled=metrics.enabled, stages=metrics.summary(),
+                caches={name: cache.info() for name, cache in (caches or {}).items()})
+
+    return server
+
+
+# enable with GRAPH_BUILDER_METRICS=1, log requests slower than
+# GRAPH_BUILDER_SLOW seconds
+metrics = Metrics(enabled=os.environ.get('GRAPH_BUILDER_METRICS') == '1',
+        slow_threshold=float(os.environ['GRAPH_BUILDER_SLOW'])
+        if 'GRAPH_BUILDER_SLOW' in os.environ else None)
@@ -0,0 +1,65 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from dash import Patch
+
+def same(a, b):
+    """
+    Deep equality of figure property values, including numpy arrays.
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    elif isinstance(a, (np.ndarray, list, tuple)) and isinstance(b, (np.ndarray, list, tuple)):
+        a, b = np.asarray(a), np.asarray(b)
+        if a.shape != b.shape or a.dtype != b.dtype:
+            return False
+        elif a.dtype.kind == 'O':
+            return all(same(p, q) for p, q in zip(a.ravel(), b.ravel()))
+        return np.array_equal(a, b, equal_nan=a.dtype.kind in 'fcmM')
+    elif isinstance(a, (np.ndarray, list, tuple)) or isinstance(b, (np.ndarray, list, tuple)):
+        return False
+    try:
+        return bool(a == b) or (a != a and b != b) # NaN equals NaN here
+    except (TypeError, ValueError):
+        return False
+
+
+def _patch_properties(patch, old, new):
+    changed = False
+    for key in old.keys() - new.keys():
+        del patch[key]
+        changed = True
+    for key, value in new.items():
+        if key not in old or not same(old[key], value):
+            patch[key] = value
+            changed = True
+    return changed
+
+
+def figure_patch(old, new):
+    """
+    Partial update turning figure old into figure new, replacing only the
+    trace and layout properties that differ.
+
+    Inputs:
+      old, new: plotly figures or figure dicts
+    Outputs:
+      (patch, changed), patch being None when the traces can't be
+      matched one to one (different number or types of traces)
+    """
+    old = old.to_dict() if hasattr(old, 'to_dict') else old
+    new = new.to_dict() if hasattr(new, 'to_dict') else new
+    olddata, newdata = old.get('data', []), new.get('data', [])
+    if (len(olddata) != len(newdata) or
+            any(a.get('type') != b.get('type') for a, b in zip(olddata, newdata))):
+        return None, True
+
+    patch = Patch()
+    changed = False
+    for i, (a, b) in enumerate(zip(olddata, newdata)):
+        changed |= _patch_properties(patch['data'][i], a, b)
+    changed |= _patch_properties(patch['layout'], old.get('layout', {}), new.get('layout', {}))
+    return patch, changed
@@ -0,0 +1,179 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+import data
+import backend
+
+logger = logging.getLogger(__name__)
+
+def file_source(path):
+    """
+    Fetch function reading a csv dropped at path, when it changed since
+    the last fetch. Returns None when there's nothing new.
+    """
+    last = {}
+
+    def fetch():
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if last.get('mtime') == mtime:
+            return None
+        table = data.read_source(path)
+        last['mtime'] = mtime
+        return table
+
+    return fetch
+
+
+def download_due(max_age=7):
+    """
+    Whether the last download (see last-update.txt) is more than max_age
+    days old.
+    """
+    try:
+        with open('last-update.txt', 'r') as _:
+            dtime = datetime.strptime(_.read().strip('\n'), '%Y-%m-%d')
+        return (datetime.now() - dtime).days > max_age
+    except (FileNotFoundError, ValueError):
+        return True
+
+
+def url_source(url, csv_path='data.csv', max_age=7):
+    """
+    Fetch function downloading the source when the last download is more
+    than max_age days old (see download_due). Returns None when there's
+    nothing new.
+    """
+    def fetch():
+        if not download_due(max_age):
+            return None
+        data.download(url, csv_path)
+        return data.read_source(csv_path)
+
+    return fetch
+
+
+class Refresher:
+    """
+    Background thread fetching new data every interval seconds, merging
+    it into the current table (see data.merge_rows) and swapping in a new
+    dataset version when rows were added or changed (see data.swap).
+    """
+
+    def __init__(self, fetch, interval=3600, columnar_path='data.feather'):
+        self.fetch = fetch
+        self.interval = interval
+        self.columnar_path = columnar_path
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """
+        Fetch and merge once. Returns the new dataset, None when the data
+        didn't change.
+        """
+        table = self.fetch()
+        if table is None:
+            return None
+        merged, added, changed = data.merge_rows(data.current().table, table)
+        if not (added or changed):
+            return None
+        if self.columnar_path is not None:
+            try: # loaded instead of the older csv on the next start
+                data.write_columnar(merged, self.columnar_path)
+            except ImportError:
+                pass
+        dataset = data.swap(merged)
+        logger.info('data version %d: %d rows added, %d changed',
+                dataset.version, added, changed)
+        return dataset
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('data refresh failed')
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='data-refresh', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class Follower(Refresher):
+    """
+    Refresher of a process attached to data published by another (see
+    data.share): swaps in every newly published version instead of
+    fetching, checking every interval seconds.
+    """
+
+    def __init__(self, interval=5):
+        super().__init__(None, interval, None)
+
+    def refresh(self):
+        dataset = data.follow()
+        if dataset is not None:
+            logger.info('attached data version %d', dataset.version)
+        return dataset
+
+
+class SQLiteRefresher(Refresher):
+    """
+    Refresher of the sqlite backend (see backend.configure), which never
+    loads the table: the process building the SQLite file (see
+    backend.builds) rebuilds it in chunks from the source csv when the
+    csv changed, downloading urls to csv_path every max_age days, and
+    every process switches to the versions written (see
+    backend.refresh_sqlite). The file is rebuilt from the latest csv
+    rather than merged with it (see data.merge_rows), the csv being the
+    whole table. Processes which don't build check every follow_interval
+    seconds.
+    """
+
+    def __init__(self, path_or_url, interval=3600, csv_path='data.csv',
+            max_age=7, follow_interval=5):
+        super().__init__(None, interval, None)
+        self.path_or_url = path_or_url
+        self.csv_path = csv_path if '://' in path_or_url else path_or_url
+        self.max_age = max_age
+        self.build_interval = interval
+        self.follow_interval = follow_interval
+
+    def refresh(self):
+        builds = backend.builds(backend.current().path)
+        self.interval = self.build_interval if builds else self.follow_interval
+        if builds and self.csv_path != self.path_or_url and download_due(self.max_age):
+            data.download(self.path_or_url, self.csv_path)
+        if not os.path.exists(self.csv_path):
+            return None
+        source = backend.refresh_sqlite(self.csv_path)
+        if source is not None:
+            logger.info('sqlite data version %d', source.version)
+        return source
+
+
+def source_fetch(path_or_url):
+    """
+    Fetch function for a url (downloaded weekly) or a local file drop.
+    """
+    if '://' in path_or_url:
+        return url_source(path_or_url)
+    return file_source(path_or_url)
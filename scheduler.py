@@ -0,0 +1,83 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Superseded(Exception):
+    """
+    A later request of the same session came in, so the result of this
+    one would never be shown.
+    """
+
+
+class _Session:
+
+    def __init__(self):
+        self.latest = 0 # ticket of the last request
+        self.running = threading.Lock() # held by the job of the session running
+
+
+class Scheduler:
+    """
+    Runs requests in a pool of max_workers threads, one request per
+    session at a time, and coalesces bursts of requests to the latest.
+
+    A request waiting while its session has a job running is dropped when
+    a later request of the session comes in. A running job calls
+    checkpoint between its stages and stops there once superseded, since
+    threads can't be interrupted. Dropped requests raise Superseded in
+    the caller.
+    """
+
+    def __init__(self, max_workers=None):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='scheduler')
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._local = threading.local()
+
+    def run(self, session, f, *args):
+        """
+        f(*args) run in the pool for the session, its result returned to
+        the calling thread. The calling thread blocks until then: the pool
+        bounds the figures built at once, while every waiting request
+        still holds a server thread. Thread-local state of the caller,
+        e.g. the request of metrics (see metrics.Metrics.bind), is not
+        seen by f unless bound to it. A None session runs at once in the
+        calling thread, as a request nothing can supersede.
+        """
+        if session is None:
+            return f(*args)
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is None:
+                state = self._sessions[session] = _Session()
+            state.latest += 1
+            ticket = state.latest
+        try:
+            with state.running:
+                if ticket != state.latest:
+                    raise Superseded()
+                return self._executor.submit(self._call, state, ticket, f, args).result()
+        finally:
+            with self._lock: # sessions without pending requests are forgotten
+                if state.latest == ticket and self._sessions.get(session) is state:
+                    del self._sessions[session]
+
+    def _call(self, state, ticket, f, args):
+        self._local.job = state, ticket
+        try:
+            return f(*args)
+        finally:
+            self._local.job = None
+
+    def checkpoint(self):
+        """
+        Raise Superseded in a job whose session had a later request since
+        the job started. Does nothing outside jobs.
+        """
+        job = getattr(self._local, 'job', None)
+        if job is not None and job[0].latest != job[1]:
+            raise Superseded()
@@ -0,0 +1,92 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+
+class Schema:
+    """
+    Roles of the columns of a table, 'continuous' for numbers and dates
+    and 'discrete' for everything else (strings, categories, booleans).
+    Indexing by column name gives the role.
+    """
+
+    def __init__(self, roles):
+        self.roles = dict(roles)
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls({k: role(v) for k, v in df.dtypes.items()})
+
+    def __getitem__(self, col):
+        return self.roles[col]
+
+    def __contains__(self, col):
+        return col in self.roles
+
+    def is_continuous(self, col):
+        return self.roles[col] == 'continuous'
+
+    def is_discrete(self, col):
+        return self.roles[col] == 'discrete'
+
+    @property
+    def continuous(self):
+        return [k for k, v in self.roles.items() if v == 'continuous']
+
+    @property
+    def discrete(self):
+        return [k for k, v in self.roles.items() if v == 'discrete']
+
+
+def role(dtype):
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'discrete'
+    return 'continuous' if dtype.kind in 'iufM' else 'discrete'
+
+
+def compact_column(series, category_ratio=0.5):
+    """
+    Smallest lossless dtype for a column: strings with few distinct values
+    become categories, integers and floats are downcast when every value
+    is kept exactly.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return series
+    elif dtype.kind == 'i' or dtype.kind == 'u':
+        return pd.to_numeric(series, downcast='integer' if dtype.kind == 'i' else 'unsigned')
+    elif dtype.kind == 'f' and dtype.itemsize > 4:
+        narrow = series.astype(np.float32)
+        if np.array_equal(narrow.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+            return narrow
+        return series
+    elif pd.api.types.is_string_dtype(series):
+        if series.nunique() <= category_ratio * len(series):
+            return series.astype('category')
+    return series
+
+
+def compact(df, category_ratio=0.5):
+    """
+    Convert every column of df to its compact dtype (see compact_column).
+    """
+    return pd.DataFrame({col: compact_column(df[col], category_ratio)
+        for col in df.columns}, index=df.index)
+
+
+def common_dtype(a, b):
+    """
+    Dtype holding the values of the dtypes a and b, e.g. of a column
+    compacted in parts (see compact_column). b when a is None.
+    """
+    if a is None or a == b:
+        return b
+    categorical = isinstance(a, pd.CategoricalDtype), isinstance(b, pd.CategoricalDtype)
+    if all(categorical):
+        return pd.CategoricalDtype()
+    if not any(categorical) and a.kind in 'biuf' and b.kind in 'biuf':
+        return np.result_type(a, b)
+    return np.dtype(object)
@@ -0,0 +1,104 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import base64
+import importlib.util
+import numpy as np
+import plotly.io.json
+
+# typed arrays understood by plotly.js, see its 'bdata' data array spec
+typed_dtypes = {np.dtype(k): k for k in ('i1', 'u1', 'i2', 'u2', 'i4', 'u4', 'f4', 'f8')}
+trace_arrays = (('x',), ('y',), ('z',), ('marker', 'size'),
+        # precomputed box plot statistics
+        ('q1',), ('median',), ('q3',), ('mean',), ('lowerfence',), ('upperfence',))
+
+def encode_array(values):
+    """
+    Encode a numeric or datetime array as a base64 typed array, datetimes
+    as milliseconds since the epoch. Returns None for other arrays.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        ns = values.astype('datetime64[ns]')
+        values = ns.astype(np.int64) / 1e6
+        values[np.isnat(ns)] = np.nan
+    elif values.dtype.kind == 'b':
+        values = values.astype('u1')
+    elif values.dtype.kind in 'iu' and values.dtype.newbyteorder('=') not in typed_dtypes:
+        fits = values.size == 0 or (values.min() >= -2**31 and values.max() < 2**31)
+        values = values.astype('i4' if fits else 'f8')
+    elif values.dtype.kind not in 'iuf':
+        return None
+    if values.dtype.newbyteorder('=') not in typed_dtypes:
+        values = values.astype('f8')
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<'))
+    encoded = dict(dtype=typed_dtypes[values.dtype.newbyteorder('=')],
+            bdata=base64.b64encode(values).decode('ascii'))
+    if values.ndim > 1:
+        encoded['shape'] = ', '.join(map(str, values.shape))
+    return encoded
+
+
+def compact_figure(fig):
+    """
+    Figure as a dict whose trace arrays (x, y, z, marker sizes, box plot
+    statistics) are base64 typed arrays instead of JSON lists. Axes showing
+    encoded datetimes are set to type 'date', as plotly reads their numbers
+    as epoch milliseconds.
+    Customdata, formatted hover strings, becomes a unicode array.
+    """
+    fig = fig.to_dict()
+    layout = fig.setdefault('layout', {})
+    for trace in fig.get('data', []):
+        for path in trace_arrays:
+            parent = trace
+            for key in path[:-1]:
+                parent = parent.get(key, {})
+            value = parent.get(path[-1])
+            if not isinstance(value, (np.ndarray, list, tuple)):
+                continue # unset, scalar or already encoded
+            encoded = encode_array(value)
+            if encoded is None:
+                continue
+            parent[path[-1]] = encoded
+            if np.asarray(value).dtype.kind == 'M' and path[0] in 'xy':
+                axis = path[0] + 'axis' + trace.get(path[0] + 'axis', path[0])[1:]
+                layout.setdefault(axis, {})['type'] = 'date'
+        # as a unicode array JSON encoders take strings in one tolist, object
+        # arrays are walked element by element
+        customdata = trace.get('customdata')
+        if isinstance(customdata, np.ndarray) and customdata.dtype.kind == 'O':
+            trace['customdata'] = customdata.astype(str)
+    return fig
+
+
+def figure_nbytes(value):
+    """
+    Approximate size in bytes of a figure dict as made by compact_figure:
+    its strings and arrays, walking dicts, lists and tuples, other values
+    counting 8 bytes.
+    """
+    if isinstance(value, dict):
+        return sum(figure_nbytes(k) + figure_nbytes(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return sum(map(figure_nbytes, value))
+    elif isinstance(value, np.ndarray):
+        if value.dtype.kind == 'O':
+            return sum(map(figure_nbytes, value.ravel()))
+        return value.nbytes
+    elif isinstance(value, str):
+        return len(value)
+    return 8
+
+
+def use_fast_json():
+    """
+    Serialize figures (also Dash callback outputs) with orjson when it is
+    installed.
+    """
+    if importlib.util.find_spec('orjson') is None:
+        return False
+    plotly.io.json.config.default_engine = 'orjson'
+    return True
@@ -0,0 +1,107 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import copy
+import json
+import os
+import re
+import uuid
+from threading import Lock
+from urllib.parse import parse_qs
+import dash
+from dash.dependencies import Input, Output, State
+from cache import LRUCache
+
+def new_state():
+    """
+    State of a new session: column aliases, the filters last applied and
+    the histories shown in the alias and filter text areas.
+    """
+    return dict(aliases={}, alias_history=[], filters=[], filter_history=[])
+
+
+class SessionStore:
+    """
+    Per-session state kept on the server, the browser holding only the
+    session key. The last maxsize sessions are kept in memory. With a
+    directory, every session is also saved as a JSON file, so sessions
+    can be restored after a restart or from another browser.
+    """
+
+    def __init__(self, directory=None, maxsize=1024):
+        self.directory = directory
+        self._sessions = LRUCache(maxsize)
+        self._lock = Lock()
+
+    @staticmethod
+    def new_key():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def valid(key):
+        return isinstance(key, str) and re.fullmatch('[0-9a-f]{32}', key) is not None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _load(self, key):
+        state = self._sessions.get(key)
+        if state is None and self.directory is not None and self.valid(key):
+            try:
+                with open(self._path(key), 'r') as _:
+                    state = json.load(_)
+            except FileNotFoundError:
+                pass
+        return new_state() if state is None else state
+
+    def __contains__(self, key):
+        return key in self._sessions or (self.directory is not None and
+                self.valid(key) and os.path.exists(self._path(key)))
+
+    def get(self, key):
+        """
+        Copy of the state of the session, a new state for unknown keys.
+        """
+        with self._lock:
+            return copy.deepcopy(self._load(key))
+
+    def update(self, key, f):
+        """
+        Apply f to the state of the session in place and save it.
+        Returns a copy of the updated state.
+        """
+        if not self.valid(key):
+            raise ValueError(f'invalid session key {key!r}')
+        with self._lock:
+            state = self._load(key)
+            f(state)
+            self._sessions.put(key, state)
+            if self.directory is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                # written aside and renamed, a crash never leaves half a file
+                with open(self._path(key) + '.tmp', 'w') as _:
+                    json.dump(state, _)
+                os.replace(self._path(key) + '.tmp', self._path(key))
+            return copy.deepcopy(state)
+
+
+def assign_session(app):
+    """
+    Give the browser a session key, kept in local storage. Opening the app
+    with ?session=<key> restores that saved session instead.
+    """
+    @app.callback(
+        Output('session-key', 'data'),
+        Input('url', 'search'),
+        State('session-key', 'data'))
+    def session_key(search, key):
+        shared = parse_qs((search or '').lstrip('?')).get('session', [None])[-1]
+        if SessionStore.valid(shared) and shared != key:
+            return shared
+        if SessionStore.valid(key):
+            return dash.no_update
+        return SessionStore.new_key()
+
+    return app
@@ -3,16 +3,149 @@ Copyright (C) 2020 David Ollodart
 GNU General Public License <https://www.gnu.org/licenses/>.
 """
 import numpy as np
-from scipy import sparse
-from scipy.sparse.linalg import spsolve
+from functools import lru_cache
+from scipy.linalg import cholesky_banded, cho_solve_banded
 from dash.dependencies import Input, Output
 from layouts import show, hide
 
-def whittaker_smooth(y, lmbd):
+def difference_bands(L, x=None):
+    """
+    Second order (divided) differences as the three diagonals of the
+    (L - 2) x L difference matrix D, one row per diagonal.
+
+    For unevenly spaced x the differences are divided by the spacing,
+    scaled so that the mean spacing is one. Evenly spaced x then gives the
+    usual [1, -2, 1] and lmbd keeps the same meaning either way.
+    """
+
+    if x is None:
+        return np.tile([[1.], [-2.], [1.]], (1, L - 2))
+    h = np.diff(x)
+    h = h / h.mean()
+    h0, h1 = h[:-1], h[1:]
+    scale = 2 / (h0 + h1)
+    return np.vstack((scale / h0, -scale * (1 / h0 + 1 / h1), scale / h1))
+
+
+def penalty_bands(d, lmbd, w=None):
+    """
+    Upper banded form of the pentadiagonal W + lmbd D'D from the
+    diagonals d of D (see difference_bands) and the weights w, W being
+    the identity when no weights are given.
+    """
+
+    L = d.shape[1] + 2
+    ab = np.zeros((3, L))
+    # D'D[j, k] sums d[j - i] * d[k - i] over the rows i touching j and k
+    for u in range(3):
+        for v in range(u, 3):
+            band = lmbd * d[u] * d[v]
+            np.add.at(ab[2 - (v - u)], np.arange(L - 2) + v, band)
+    ab[2] += 1 if w is None else w
+    return ab
+
+
+@lru_cache(maxsize=128)
+def whittaker_factor(L, lmbd):
+    """
+    Banded Cholesky factor for evenly spaced series, cached per (L, lmbd).
+    """
+    return cholesky_banded(penalty_bands(difference_bands(L), lmbd))
+
+
+def _positions(h):
+    return np.concatenate(([0.], np.cumsum(np.frombuffer(h))))
+
+
+@lru_cache(maxsize=128)
+def _spaced_factor(h, lmbd):
+    x = _positions(h)
+    return cholesky_banded(penalty_bands(difference_bands(len(x), x), lmbd))
+
+
+def _spacing(x):
+    """
+    Spacing of the positions x as bytes (hashable), None when x is None
+    or can't be divided by.
+    """
+    if x is None:
+        return None
+    x = np.asarray(x)
+    if x.dtype.kind == 'M':
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    h = np.diff(x.astype(float))
+    # repeated, unsorted or nearly coincident x can't be divided by,
+    # treat as evenly spaced
+    if (len(h) and np.all(np.isfinite(h)) and np.all(h > 1e-3 * h.mean()) and
+            not np.all(h == h[0])):
+        return h.tobytes()
+    return None
+
+
+def _factor(L, lmbd, h, w=None):
+    """
+    Banded Cholesky factor for the spacing h (see _spacing) and weights w.
+    Spacings whose system is numerically singular fall back to even spacing.
+    """
+    try:
+        if w is not None:
+            x = None if h is None else _positions(h)
+            return cholesky_banded(penalty_bands(difference_bands(L, x), lmbd, w))
+        elif h is not None:
+            return _spaced_factor(h, lmbd)
+    except np.linalg.LinAlgError:
+        if h is not None:
+            return _factor(L, lmbd, None, w)
+        raise
+    return whittaker_factor(L, lmbd)
+
+
+def whittaker_smooth_batch(Y, lmbd, x=None):
+    """
+    Whittaker smoothing of the columns of Y, which share one factorization.
+    Missing values get zero weight and are interpolated, columns with
+    missing values are solved on their own.
+
+    Inputs:
+      Y: data array, one series per column, or a single series
+      lmbd: smoothing parameter
+      x: optional sample positions (numeric or datetime), shared by all
+         columns
+    Outputs:
+      Z: smoothed data, same shape as Y
+    """
+
+    Y = np.asarray(Y, dtype=float)
+    if Y.ndim == 1:
+        return whittaker_smooth_batch(Y.reshape(-1, 1), lmbd, x).ravel()
+    L = Y.shape[0]
+    if L < 3:
+        return Y.copy()
+    h, lmbd = _spacing(x), float(lmbd)
+
+    finite = np.isfinite(Y)
+    complete = finite.all(axis=0)
+    Z = np.empty_like(Y)
+    if complete.all():
+        return cho_solve_banded((_factor(L, lmbd, h), False), Y)
+    elif complete.any():
+        Z[:, complete] = cho_solve_banded((_factor(L, lmbd, h), False), Y[:, complete])
+    for i in np.flatnonzero(~complete):
+        w = finite[:, i].astype(float)
+        if w.sum() < 2: # the smoother can't place a line through fewer points
+            Z[:, i] = np.nan
+            continue
+        Z[:, i] = cho_solve_banded((_factor(L, lmbd, h, w), False),
+                np.where(finite[:, i], Y[:, i], 0.))
+    return Z
+
+
+def whittaker_smooth(y, lmbd, x=None):
 
     """
     Whittaker smoothing algorithm.
-    Second order differences used.
+    Second order differences used, divided differences when sample
+    positions x are given. Missing values are interpolated.
 
     Reference:
     Paul H. C. Eilers, "A perfect smoother",
@@ -22,16 +155,12 @@ def whittaker_smooth(y, lmbd):
     Inputs:
       y: data vector
       lmbd: smoothing parameter 
+      x: optional sample positions (numeric or datetime)
     Outputs:
       z: smoothed data
     """
 
-    L = len(y)
-    E = sparse.eye(L, format='csc')
-    D = sparse.diags([1, -2, 1], [0, -1, -2], shape=(L, L))
-    Z = E + lmbd * D.transpose() @ D
-    z = sparse.linalg.spsolve(Z, y)
-    return z
+    return whittaker_smooth_batch(y, lmbd, x)
 
 def assign_smooth(app):
 
@@ -48,8 +177,12 @@ def assign_smooth(app):
         elif smoother == 'whittaker':
             marks = {k:{'label':f'10^{k}'} for k in range(6)}
             return 0, 5, 2, 0.1, marks, show
-        elif smoother == 'moving-average':
+        elif smoother in ('moving-average', 'centered-average'):
             marks = {k:{'label':f'{k}'} for k in [1, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50]}
             return 1, 50, 15, 1, marks, show
+        elif smoother == 'time-average':
+            # days for datetime x, x units otherwise
+            marks = {k:{'label':f'{k}'} for k in [1, 7, 14, 21, 28, 35, 42, 49, 56]}
+            return 1, 60, 7, 1, marks, show
 
     return app
@@ -0,0 +1,193 @@
+"""
+Copyright (C) 2020 David Ollodart
+GNU General Public License <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pandas as pd
+from cache import LRUCache
+
+def bit_length(v):
+    """
+    Number of bits of each value of an unsigned 64 bit array.
+    """
+    v = v.copy()
+    n = np.zeros(v.shape, dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        big = v >> np.uint64(s) > 0
+        n += big * s
+        v[big] >>= np.uint64(s)
+    return n + (v > 0)
+
+
+class HyperLogLog:
+    """
+    Distinct count sketch of 2**p registers (relative error about
+    1.04 / 2**(p/2), under 1% for the default p), updated with 64 bit
+    hashes chunk by chunk.
+
+    Reference:
+    P. Flajolet et al., "HyperLogLog: the analysis of a near-optimal
+    cardinality estimation algorithm", AofA 2007
+    """
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(2**p, dtype=np.int64)
+
+    def update(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p = np.uint64(self.p)
+        idx = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes & np.uint64(2**(64 - self.p) - 1)
+        rank = (64 - self.p) - bit_length(rest) + 1 # leading zeros + 1
+        np.maximum.at(self.registers, idx, rank)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers)
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros: # small range correction
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class Reservoir:
+    """
+    Uniform sample without replacement of at most n values, updated chunk
+    by chunk: every value gets a random priority and the n values of
+    smallest priority are kept. Quantiles of the sample approximate those
+    of all values (rank error about 1 / sqrt(n)).
+    """
+
+    def __init__(self, n=100000, seed=0):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.values = None
+        self.priorities = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values)
+        priorities = np.concatenate((self.priorities, self.rng.random(len(values))))
+        values = values if self.values is None else np.concatenate((self.values, values))
+        if len(values) > self.n:
+            keep = np.argpartition(priorities, self.n)[:self.n]
+            values, priorities = values[keep], priorities[keep]
+        self.values, self.priorities = values, priorities
+        return self
+
+
+class ColumnStats:
+    """
+    Statistics of the columns of one backend (so of one dataset version),
+    computed on first use and cached per column and filter state.
+
+    Up to exact_rows rows the statistics are exact. Larger columns are
+    streamed from the backend in chunks of chunksize rows into sketches,
+    HyperLogLog for distinct counts and a sample of sample_size values for
+    quantiles, so their memory doesn't grow with the rows.
+    """
+
+    def __init__(self, backend, exact_rows=1000000, chunksize=1000000,
+            sample_size=100000, maxsize=256):
+        self.backend = backend
+        self.exact_rows = exact_rows
+        self.chunksize = chunksize
+        self.sample_size = sample_size
+        self._cache = LRUCache(maxsize)
+
+    def _cached(self, key, f):
+        value = self._cache.get(key)
+        if value is None:
+            value = f()
+            self._cache.put(key, value)
+        return value
+
+    def _exact(self, filters):
+        return self.count(filters) <= self.exact_rows
+
+    def _values(self, column, filters):
+        return self.backend.query([column], filters)[column].dropna()
+
+    def _chunks(self, column, filters):
+        for chunk in self.backend.chunks([column], filters, self.chunksize):
+            yield chunk[column].dropna()
+
+    def count(self, filters=()):
+        """
+        Number of rows passing the filters.
+        """
+        filters = tuple(map(tuple, filters))
+        return self._cached(('count', filters), lambda: self.backend.count(filters))
+
+    def quantiles(self, column, qs, filters=()):
+        """
+        Quantiles qs of the column as a series indexed by qs, missing
+        values left out.
+        """
+        filters, qs = tuple(map(tuple, filters)), tuple(qs)
+
+        def compute():
+            if self._exact(filters):
+                return self._values(column, filters).quantile(list(qs))
+            sample = Reservoir(self.sample_size)
+            for chunk in self._chunks(column, filters):
+                sample.update(chunk.to_numpy())
+            return pd.Series(sample.values).quantile(list(qs))
+
+        return self._cached(('quantiles', column, qs, filters), compute)
+
+    def nunique(self, column, filters=()):
+        """
+        Number of distinct values of the column, missing values left out.
+        """
+        filters = tuple(map(tuple, filters))
+
+        def compute():
+            if self._exact(filters):
+                return int(self._values(column, filters).nunique())
+            sketch = HyperLogLog()
+            for chunk in self._chunks(column, filters):
+                sketch.update(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+            return sketch.count()
+
+        return self._cached(('nunique', column, filters), compute)
+
+    def uniques(self, column, filters=(), limit=None):
+        """
+        Distinct values of the column, None when there are more than limit
+        (checked on the distinct count, before grouping).
+        """
+        filters = tuple(map(tuple, filters))
+        if limit is not None and self.nunique(column, filters) > limit:
+            return None
+        return self._cached(('uniques', column, filters),
+                lambda: self.backend.levels(column, filters).index.to_numpy())
+
+    def filtered(self, filters):
+        """
+        The statistics of the rows passing the filters, with the same
+        methods taking no filters argument.
+        """
+        return _Filtered(self, tuple(map(tuple, filters)))
+
+
+class _Filtered:
+
+    def __init__(self, stats, filters):
+        self.stats = stats
+        self.filters = filters
+
+    def count(self):
+        return self.stats.count(self.filters)
+
+    def quantiles(self, column, qs):
+        return self.stats.quantiles(column, qs, self.filters)
+
+    def nunique(self, column):
+        return self.stats.nunique(column, self.filters)
+
+    def uniques(self, column, limit=None):
+        return self.stats.uniques(column, self.filters, limit)